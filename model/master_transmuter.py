@@ -1,4 +1,4 @@
-import re, math
+import re, math, os, hashlib
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -64,6 +64,107 @@ def get_seasons(df):
     seasons = [x for x in df.columns if x.strip('s').isnumeric()]
     return seasons
 
+COLORS = ['W', 'U', 'B', 'R', 'G']
+MANA_CODE_COLUMNS = ['color_identity_bits', 'colors_bits', 'mana_cost_bits', 'mana_pips']
+COLOR_COUNTS = np.array([bin(bits).count('1') for bits in range(1 << len(COLORS))], dtype=np.uint8)
+# Bump when feature engineering code changes, so FeatureCache stops serving stale features
+FEATURE_CACHE_VERSION = 2
+
+def color_bits(text):
+    """ Encodes the WUBRG colors appearing in text as a bitmask, W being the lowest bit """
+    return sum(1 << i for i, color in enumerate(COLORS) if color in text)
+
+def pip_count(mana_cost):
+    """ Counts colored mana symbols in a mana cost, eg {2}{W}{U/B} has 2 pips """
+    return len(re.findall('{[^}]*[WUBRG][^}]*}', mana_cost))
+
+def encode_distinct(series, encoder):
+    """ Applies encoder once per distinct value of series, and broadcasts the uint8 results back onto rows """
+    codes, uniques = pd.factorize(series.fillna('').astype(str))
+    encoded = np.array([encoder(value) for value in uniques], dtype=np.uint8)
+    return encoded[codes]
+
+def mana_codes(df):
+    """
+    Encodes color_identity, colors & mana_cost into compact uint8 columns in one pass over their distinct values:
+        color_identity_bits, colors_bits, mana_cost_bits: WUBRG bitmasks
+        mana_pips: number of colored mana symbols in mana_cost
+    Returns DataFrame with the same index as df
+    """
+    codes_df = pd.DataFrame(index=df.index)
+    codes_df['color_identity_bits'] = encode_distinct(df['color_identity'], color_bits)
+    codes_df['colors_bits'] = encode_distinct(df['colors'], color_bits)
+    codes_df['mana_cost_bits'] = encode_distinct(df['mana_cost'], color_bits)
+    codes_df['mana_pips'] = encode_distinct(df['mana_cost'], pip_count)
+    return codes_df
+
+def creature_features(power, toughness, cmc):
+    """
+    Parses power & toughness numerically in one pass; anything that doesn't parse ('*', '1+*', etc.)
+    or has toughness <= 0 is variable, and cards without P/T are none. Only static P/Ts get ratio features.
+    Returns dict of column name: array
+    """
+    has_pt = (power.notnull() & toughness.notnull()).values
+    power = pd.to_numeric(power, errors='coerce').values
+    toughness = pd.to_numeric(toughness, errors='coerce').values
+    with np.errstate(invalid='ignore'):
+        static = has_pt & ~np.isnan(power) & ~np.isnan(toughness) & (toughness > 0)
+
+    # Convert static pts to ints
+    power = np.where(static, power, 0).astype(np.int64)
+    toughness = np.where(static, toughness, 0).astype(np.int64)
+
+    # Only engineer creatures with static PT
+    pt_ratio = np.full(power.shape[0], np.nan)
+    avg_pt = np.full(power.shape[0], np.nan)
+    cmc_apt = np.full(power.shape[0], np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.divide(power, toughness, out=pt_ratio, where=static)
+        np.add(power, toughness, out=avg_pt, where=static)
+        np.divide(avg_pt, 2, out=avg_pt, where=static)
+        np.divide(cmc.values.astype(np.float64), avg_pt, out=cmc_apt, where=static)
+
+    return {
+        'pt_type': np.select([static, has_pt], ['static', 'variable'], 'none'),
+        'power': power,
+        'toughness': toughness,
+        'p:t': pt_ratio,
+        'avg_pt': avg_pt,
+        'cmc:apt': cmc_apt,
+    }
+
+def loyalty_features(loyalty):
+    """
+    Parses loyalty into integers, and l_type into a categorical; integer loyalties are static,
+    anything else (X, missing, etc.) is variable with loyalty 0. Returns dict of column name: array
+    """
+    loyalty = pd.to_numeric(loyalty, errors='coerce').values.astype(np.float64)
+    with np.errstate(invalid='ignore'):
+        static = np.isfinite(loyalty) & (loyalty == np.floor(loyalty))
+
+    return {
+        'loyalty': np.where(static, loyalty, 0).astype(np.int64),
+        'l_type': pd.Categorical(np.where(static, 'static', 'variable'), categories=['static', 'variable']),
+    }
+
+def ability_counts(oracle_text):
+    """ Counts ability blocks, activated, triggered, and mana abilities in oracle text. Returns dict of column name: Series """
+    txt = oracle_text.fillna('').astype(str)
+    return {
+        'ability_sects': txt.str.count('\r\r\n') + 1,
+        'activated': txt.str.count(':'),
+        'triggered': txt.str.count('When|At|As'),
+        'mana_abilities': txt.str.count('Add|add'),
+    }
+
+def add_mana_codes(df):
+    """ Adds mana_codes columns to df in place, unless an earlier stage already did """
+    if not set(MANA_CODE_COLUMNS) <= set(df.columns):
+        codes_df = mana_codes(df)
+        for col in MANA_CODE_COLUMNS:
+            df[col] = codes_df[col].values
+    return df
+
 
 class OneHotTransformer(BaseEstimator, TransformerMixin):
     """
@@ -138,13 +239,15 @@ class FillnaTransformer(BaseEstimator, TransformerMixin):
         if self.is_seasonal:
             seasons = self._get_seasons(df)
             non_seasons = list(set(df.columns) - set(seasons))
-            df[non_seasons] = df[non_seasons].fillna(self.fill_value, axis=1)
+            df[non_seasons] = df[non_seasons].fillna(self.fill_value)
         else: 
-            df = df.fillna(self.fill_value, axis=1)
+            df = df.fillna(self.fill_value)
         return df
 
 class CostIntensityTransformer(BaseEstimator, TransformerMixin):
     """Add engineered features to DataFrame."""
+    input_columns = ['color_identity', 'colors', 'mana_cost']
+    feature_columns = MANA_CODE_COLUMNS + ['mana_intensity', 'color_intensity']
 
     def fit(self, X, y=None):
         """Does not save state"""
@@ -152,24 +255,20 @@ class CostIntensityTransformer(BaseEstimator, TransformerMixin):
 
     def transform(self, X):
         """Derives additional features used in the training of models."""
-        df = X.copy()
+        df = add_mana_codes(X.copy())
 
-        def colors(row):
-            try:
-                intensity = len(row['mana_cost'])
-                if (intensity == 3) & (row['mana_cost'][1] not in ['W', 'U', 'B', 'R', 'G']):
-                    return 0
-                else: 
-                    return intensity
-            except:
-                return 0
         # Difficulty casting
-        df['mana_intensity'] = df['mana_cost'].apply(lambda x: colors(x))-2
-        df['color_intensity'] = df['color_identity'].apply(lambda x: len(x)-2)
+        df['mana_intensity'] = df['mana_pips'].astype(np.int64)
+        df['color_intensity'] = COLOR_COUNTS[df['color_identity_bits'].values].astype(np.int64)
         return df
 
 class CreatureFeatureTransformer(BaseEstimator, TransformerMixin):
     """Add engineered creature features to DataFrame."""
+    input_columns = ['power', 'toughness', 'cmc']
+    feature_columns = ['pt_type', 'power', 'toughness', 'p:t', 'avg_pt', 'cmc:apt']
+
+    def __init__(self, vectorized=True):
+        self.vectorized = vectorized
 
     def fit(self, X, y=None):
         """Does not save state"""
@@ -178,6 +277,20 @@ class CreatureFeatureTransformer(BaseEstimator, TransformerMixin):
 
     def transform(self, X):
         """Derives additional features used in the training of models."""
+        if self.vectorized:
+            return self._transform_columnar(X)
+        return self._transform_rows(X)
+
+    def _transform_columnar(self, X):
+        """Single pass creature features; see creature_features"""
+        df = X.copy()
+        for col, values in creature_features(df['power'], df['toughness'], df['cmc']).items():
+            df[col] = values
+
+        return df
+
+    def _transform_rows(self, X):
+        """Row-wise creature features; reference implementation for the columnar path"""
         df = X.copy()
 
         # Creature Features
@@ -214,7 +327,9 @@ class CreatureFeatureTransformer(BaseEstimator, TransformerMixin):
         return df
 
 class PlaneswalkerTransformer(BaseEstimator, TransformerMixin):
-    """Add engineered creature features to DataFrame."""
+    """Add engineered planeswalker features to DataFrame."""
+    input_columns = ['loyalty']
+    feature_columns = ['loyalty', 'l_type']
 
     def fit(self, X, y=None):
         """Does not save state"""
@@ -222,21 +337,14 @@ class PlaneswalkerTransformer(BaseEstimator, TransformerMixin):
         return self
 
     def transform(self, X):
-        """Derives additional features used in the training of models."""
+        """
+        Parses loyalty into an integer column, and l_type into a categorical column; integer loyalties are
+        static, anything else (X, missing, etc.) is variable with loyalty 0. Other columns are left untouched.
+        """
         df = X.copy()
-        def loyal_type(row):
-            try:
-                loyal = int(row['loyalty'])
-                row['loyalty']=loyal
-                row['l_type']='static'
-                return row
-            except:
-                row['loyalty']=0
-                row['l_type']='variable'
-                return row
-
-        df = df.apply(loyal_type, axis=1)
-        
+        for col, values in loyalty_features(df['loyalty']).items():
+            df[col] = values
+
         return df
 
 class DropFeaturesTransformer(BaseEstimator, TransformerMixin):
@@ -260,6 +368,10 @@ class DropFeaturesTransformer(BaseEstimator, TransformerMixin):
             ,'l_type'
             ,'pt_type'
             ,'layout'
+            ,'color_identity_bits'
+            ,'colors_bits'
+            ,'mana_cost_bits'
+            ,'mana_pips'
             # ,'price'
         ]
         if not is_seasonal:
@@ -368,43 +480,81 @@ class TestFillTransformer(BaseEstimator, TransformerMixin):
 
 class TypelineTransformer(BaseEstimator, TransformerMixin):
     """Creates Dummies for typeline"""
-    def __init__(self):
+    def __init__(self, vectorized=True):
+        self.vectorized = vectorized
         self.card_types = set(['Creature','Land','Instant','Sorcery','Enchantment','Artifact','Planeswalker'])
         self.sub_types = set()
         self.mod_types = set()
 
+    def _split_types(self, type_line):
+        """ Parses a type line into sets of (card types, mod types, sub types), cleaving split cards and transforms """
+        card_types = set()
+        sub_types = set()
+        mod_types = set()
+        for subcard in type_line.split('//'):
+            types = subcard.split(' — ')
+            card_types.update(set(types[0].split()) & self.card_types)
+            mod_types.update(set(types[0].split()) - self.card_types)
+            if len(types) > 1:
+                sub_types.update(set(types[1].split()))
+        return card_types, mod_types, sub_types
+
     def fit(self, X, y=None):
         """identifies all subtypes"""
-        # Cleave split cards and transforms
-        cards = [x.split('//') for x in X['type_line'].unique()]
-        for card in cards:
-            for subcard in card:
-                types = subcard.split(' — ')
-                self.mod_types.update(set(types[0].split()) - self.card_types)
-                try:
-                    self.sub_types.update(set(types[1].split()))
-                except:
-                    pass
-                    
+        for type_line in X['type_line'].unique():
+            _, mod_types, sub_types = self._split_types(type_line)
+            self.mod_types.update(mod_types)
+            self.sub_types.update(sub_types)
+
         return self
 
     def transform(self, X):
         """Creates type dummies for main types"""
+        if self.vectorized:
+            return self._transform_columnar(X)
+        return self._transform_rows(X)
+
+    def _transform_columnar(self, X):
+        """
+        Parses each distinct type line once, builds an indicator matrix of types by distinct
+        type line, and joins it back onto the rows by type line code
+        """
+        df = X.copy()
+        codes, parsed, dummy_types, indicator = self._type_indicator(df['type_line'])
+
+        # Set-valued columns, shared between rows with the same type line
+        for i, col in enumerate(['card_types', 'mod_types', 'sub_types']):
+            type_sets = np.empty(len(parsed), dtype=object)
+            type_sets[:] = [types[i] for types in parsed]
+            df[col] = type_sets[codes]
+
+        dummies = pd.DataFrame(indicator[codes], index=df.index, columns=dummy_types)
+        df = df.drop(columns=list(set(dummy_types) & set(df.columns)))
+        return pd.concat([df, dummies], axis=1)
+
+    def _type_indicator(self, type_line):
+        """
+        Parses each distinct type line once. Returns the row codes into the distinct type lines, their parsed type sets,
+        the dummy type names, and the (distinct type lines x dummy types) indicator matrix of card & mod type membership
+        """
+        codes, type_lines = pd.factorize(type_line.fillna(''))
+        parsed = [self._split_types(line) for line in type_lines]
+
+        dummy_types = sorted(self.card_types) + sorted(self.mod_types)
+        type_index = {type_name: j for j, type_name in enumerate(dummy_types)}
+        indicator = np.zeros((len(parsed), len(dummy_types)), dtype=np.int64)
+        for i, (card_types, mod_types, _) in enumerate(parsed):
+            for type_name in (card_types & self.card_types) | (mod_types & self.mod_types):
+                indicator[i, type_index[type_name]] = 1
+
+        return codes, parsed, dummy_types, indicator
+
+    def _transform_rows(self, X):
+        """Row-wise type dummies; reference implementation for the columnar path"""
         df = X.copy()
 
         def type_sets(row):
-            card_types = set()
-            sub_types = set()
-            mod_types = set()
-            card = row['type_line'].split('//')
-            for subcard in card:
-                types = subcard.split(' — ')
-                card_types.update(set(types[0].split()) & self.card_types)
-                mod_types.update(set(types[0].split()) - self.card_types)
-                try:
-                    sub_types.update(set(types[1].split()))
-                except:
-                    pass
+            card_types, mod_types, sub_types = self._split_types(row['type_line'])
             row['card_types'] = card_types
             row['mod_types'] = mod_types
             row['sub_types'] = sub_types
@@ -434,20 +584,20 @@ class ColorIDTransformer(BaseEstimator, TransformerMixin):
 
     def transform(self, X):
         """Dummifies color identity for each card"""
-        df = X.copy()
-
-        def color_dummies(row):
-            for color in self.colors:
-                row[color] = 1*(color in row['color_identity'])
-            return row
+        df = add_mana_codes(X.copy())
 
         # Dummify color identity membership
-        df = df.apply(color_dummies, axis=1)
+        identity_bits = df['color_identity_bits'].values.astype(np.int64)
+        for i, color in enumerate(COLORS):
+            if color in self.colors:
+                df[color] = (identity_bits >> i) & 1
 
         return df
 
 class AbilityCountsTransformer(BaseEstimator, TransformerMixin):
     """Creates counts for various ability types"""
+    input_columns = ['oracle_text']
+    feature_columns = ['ability_sects', 'activated', 'triggered', 'mana_abilities']
 
     def fit(self, X, y=None):
         """No saved state"""
@@ -456,31 +606,174 @@ class AbilityCountsTransformer(BaseEstimator, TransformerMixin):
     def transform(self, X):
         """Reads text and counts ability blocks, activated, and triggered abilities"""
         df = X.copy()
+        for col, values in ability_counts(df['oracle_text']).items():
+            df[col] = values
 
-        def count_abilities(row):
-            txt = row['oracle_text']
-            if pd.isnull(txt):
-                txt = ''
-                row['ability_sects'] = len(txt.split('\r\r\n'))
-            else:
-                row['ability_sects'] = len(txt.split('\r\r\n'))
-
-            # Count ability blocks
-            row['ability_sects'] = len(txt.split('\r\r\n'))
-            # Count activated
-            row['activated'] = txt.count(':')            
-            # Count triggered
-            row['triggered'] = len(re.findall('When|At|As',txt))
-            # Count mana abilities
-            row['mana_abilities'] = len(re.findall('Add|add', txt))
-            
-            return row
+        return df
 
-        # Dummify color identity membership
-        df = df.apply(count_abilities, axis=1)
+class FeatureCache(BaseEstimator, TransformerMixin):
+    """
+    Wraps a stateless transformer (one declaring input_columns & feature_columns), caching the columns it derives on
+    disk, keyed by a hash of each row's input_columns. Other columns (prices, timestamps) don't affect the key, so a
+    store holds one entry per distinct input and only grows when new cards show up. Stores are content addressed by
+    transformer class & params, and kept as one .npz per store, so rows featurized in any earlier run or CV fold are
+    read back instead of recomputed.
+    """
+    def __init__(self, transformer, cache_dir='data/feature_cache'):
+        self.transformer = transformer
+        self.cache_dir = cache_dir
+
+    def _store_path(self):
+        """ Path of the .npz store for this transformer class, params & feature code version """
+        name = type(self.transformer).__name__
+        params = sorted((key, repr(value)) for key, value in self.transformer.get_params().items())
+        digest = hashlib.sha1(repr((name, params, FEATURE_CACHE_VERSION)).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, '{}-{}.npz'.format(name, digest))
+
+    def _load(self, path):
+        """ Returns (row keys, {column: values}, {column: categories}) in store, empty if there's no store yet """
+        if not os.path.exists(path):
+            return np.array([], dtype=np.uint64), {}, {}
+        with np.load(path, allow_pickle=False) as store:
+            columns = list(store['columns'])
+            values = {col: store['c{}'.format(i)] for i, col in enumerate(columns)}
+            categories = {col: list(store['categories{}'.format(i)]) for i, col in enumerate(columns)
+                          if 'categories{}'.format(i) in store.files}
+            return store['keys'], values, categories
+
+    def _save(self, path, keys, values, categories):
+        """ Writes store to a temp file and swaps it in, so parallel CV workers never read a partial store """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        columns = list(self.transformer.feature_columns)
+        arrays = {'keys': keys, 'columns': np.array(columns)}
+        for i, col in enumerate(columns):
+            arrays['c{}'.format(i)] = values[col]
+            if col in categories:
+                arrays['categories{}'.format(i)] = np.array(categories[col])
+        tmp_path = '{}.{}.tmp.npz'.format(path[:-len('.npz')], os.getpid())
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
 
+    def fit(self, X, y=None):
+        self.transformer.fit(X, y)
+        return self
+
+    def transform(self, X):
+        """ Serves feature_columns of X from the store, computing & storing only rows it hasn't seen """
+        df = X.copy()
+        row_keys = pd.util.hash_pandas_object(X[list(self.transformer.input_columns)], index=False).values
+        path = self._store_path()
+        keys, values, categories = self._load(path)
+
+        missing = ~np.isin(row_keys, keys)
+        if missing.any():
+            new_keys, first = np.unique(row_keys[missing], return_index=True)
+            new_df = self.transformer.transform(X[missing]).iloc[first]
+            for col in self.transformer.feature_columns:
+                column = new_df[col]
+                if isinstance(column.dtype, pd.CategoricalDtype):
+                    categories[col] = list(column.cat.categories)
+                column = column.values.astype(str) if column.dtype == object or col in categories else column.values
+                values[col] = np.concatenate([values[col], column]) if col in values else column
+            keys = np.concatenate([keys, new_keys])
+            self._save(path, keys, values, categories)
+
+        # Every row is in the store now; look up its position by key
+        order = np.argsort(keys, kind='mergesort')
+        positions = order[np.searchsorted(keys, row_keys, sorter=order)]
+        for col in self.transformer.feature_columns:
+            column = values[col][positions]
+            df[col] = pd.Categorical(column, categories=categories[col]) if col in categories else column
         return df
 
+class CardFeatureEngine(BaseEstimator, TransformerMixin):
+    """
+    Fused replacement for the BoolToInt through TestFill stages of create_pipeline. Computes the same features
+    column by column straight into one float32 matrix, instead of copying the whole frame at every stage.
+    Column names are stored in train_columns_; set as_frame to get a DataFrame wrapping the matrix instead.
+    """
+    def __init__(self, fill_value=0, test_fill_value=-1,
+                 dummy_features=['rarity','layout','pt_type','l_type'], as_frame=False):
+        self.fill_value = fill_value
+        self.test_fill_value = test_fill_value
+        self.dummy_features = dummy_features
+        self.as_frame = as_frame
+
+    def _features(self, X):
+        """ Yields (column name, values) for every engineered, dummy, and passed through feature of X, before filling NaNs """
+        yield 'reprint', 1*X['reprint'].values
+        creature = creature_features(X['power'], X['toughness'], X['cmc'])
+        loyalty = loyalty_features(X['loyalty'])
+        categoricals = {'pt_type': creature.pop('pt_type'), 'l_type': loyalty.pop('l_type')}
+        for col, values in list(creature.items()) + list(loyalty.items()):
+            yield col, values
+        for col, values in ability_counts(X['oracle_text']).items():
+            yield col, values.values
+
+        # Dummies are taken after NaN filling, as in the chained pipeline
+        for feature in self.dummy_features:
+            values = categoricals.get(feature, X.get(feature))
+            if values is None:
+                continue
+            if isinstance(values, pd.Categorical):
+                levels = values.categories
+            else:
+                values = pd.Series(values).fillna(self.fill_value).values
+                levels = pd.unique(values)
+            for level in levels:
+                yield '{}_{}'.format(feature, level), (values == level).astype(np.int64)
+
+        codes_df = mana_codes(X)
+        yield 'mana_intensity', codes_df['mana_pips'].values
+        yield 'color_intensity', COLOR_COUNTS[codes_df['color_identity_bits'].values]
+
+        codes, _, dummy_types, indicator = self.typeline_._type_indicator(X['type_line'])
+        for j, type_name in enumerate(dummy_types):
+            yield type_name, indicator[codes, j]
+
+        identity_bits = codes_df['color_identity_bits'].values.astype(np.int64)
+        for i, color in enumerate(COLORS):
+            yield color, (identity_bits >> i) & 1
+
+        for col in self.passthrough_:
+            if col in X.columns:
+                yield col, X[col].values
+
+    def fit(self, X, y=None):
+        """ Learns type line mod types, pass through columns, and the trained feature columns """
+        self.typeline_ = TypelineTransformer().fit(X)
+        consumed = set(DropFeaturesTransformer().features_to_drop) | set(self.dummy_features) | \
+                   set(['reprint', 'power', 'toughness', 'loyalty'])
+        self.passthrough_ = [col for col in X.columns if col not in consumed]
+        non_numeric = [col for col in self.passthrough_ if not pd.api.types.is_numeric_dtype(X[col])]
+        if non_numeric:
+            raise ValueError("CardFeatureEngine can only pass through numeric columns; drop or index {} first".format(non_numeric))
+        self.train_columns_ = []
+        for col, _ in self._features(X):
+            if col not in self.train_columns_:
+                self.train_columns_.append(col)
+        return self
+
+    def transform(self, X):
+        """ Returns float32 feature matrix (or DataFrame if as_frame) with columns train_columns_ """
+        try:
+            getattr(self, "train_columns_")
+        except AttributeError:
+            raise RuntimeError("train_columns_ doesn't exist; make sure you fit the engine first")
+
+        col_index = {col: j for j, col in enumerate(self.train_columns_)}
+        features = np.full((X.shape[0], len(self.train_columns_)), self.test_fill_value, dtype=np.float32)
+        for col, values in self._features(X):
+            # Features not seen in training are dropped; trained features missing here keep the test fill value
+            if col in col_index:
+                column = features[:, col_index[col]]
+                column[:] = values
+                column[np.isnan(column)] = self.fill_value
+
+        if self.as_frame:
+            return pd.DataFrame(features, index=X.index, columns=self.train_columns_)
+        return features
+
 class StandardSeasonTransformer(BaseEstimator, TransformerMixin):
     """ Add features to season matrix """
     def fit(self, X, y=None):
@@ -560,12 +853,17 @@ class StandardPriceTransformer(BaseEstimator, TransformerMixin):
     def fit(self, X, y=None):
         return self
 
-    def _standard_mask(self, row):
-        for season in self.seasons_:
-            row[season] = row[season]*self.std_sets_df.loc[row['setname']][season]
-        return row
+    def _standard_mask(self, setnames, seasons):
+        """
+        Aligns std_sets_df to setnames in one reindex, returning a (cards x seasons) array of 1 where legal, NaN where not.
+        Sets missing from std_sets_df were never standard legal, so they are masked out for every season.
+        """
+        return self.std_sets_df[seasons].reindex(setnames).values.astype(np.float64)
 
     def transform(self, X, y=None):
         """ X is seasonal prices, to be filtered for standard only """
         seasonal_prices_df = X.copy()
-        return seasonal_prices_df.apply(self._standard_mask, axis=1)
\ No newline at end of file
+        seasons = [season for season in self.seasons_ if season in seasonal_prices_df.columns]
+        std_mask = self._standard_mask(seasonal_prices_df['setname'].values, seasons)
+        seasonal_prices_df[seasons] = seasonal_prices_df[seasons].values.astype(np.float64) * std_mask
+        return seasonal_prices_df
\ No newline at end of file
@@ -10,11 +10,21 @@ from sklearn.base import BaseEstimator, TransformerMixin, RegressorMixin, clone
 from sklearn.metrics import make_scorer, mean_squared_log_error
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import GradientBoostingRegressor
+try:
+    from sklearn.ensemble import HistGradientBoostingRegressor
+except ImportError:
+    # experimental in sklearn 0.21 - 0.24, absent before
+    try:
+        from sklearn.experimental import enable_hist_gradient_boosting
+        from sklearn.ensemble import HistGradientBoostingRegressor
+    except ImportError:
+        HistGradientBoostingRegressor = None
 from sklearn.ensemble.partial_dependence import plot_partial_dependence
 from sklearn.ensemble.partial_dependence import partial_dependence
 from sklearn.model_selection import train_test_split
 from sklearn.model_selection import cross_val_score
 from sklearn.model_selection import GridSearchCV
+from joblib import Parallel, delayed
 
 def format_results(X_test, y_pred, y_test):
     results_df = X_test.copy()
@@ -158,7 +168,7 @@ def pipe_feature_imports(pipe):
     return pd.DataFrame(feature_importances[feature_importances[:,1].argsort()[::-1]], columns=['feature','importance'])
 
 def SNGBR_feature_imports(pipe):
-    model = pipe.steps[-1][1].model
+    model = pipe.steps[-1][1].model_
     features = list(pipe.steps[-1][1].train_columns_)
     feature_importances = np.round(model.feature_importances_,4)
     feature_importances = np.array([features, feature_importances]).T
@@ -286,14 +296,28 @@ def GBR_V1():
     ])
     return pipe
 
-def create_pipeline(model, modelname):
+def create_pipeline(model, modelname, fused=False, cache_dir=None):
+    """
+    Card feature pipeline ending in model. If fused, the feature stages are replaced by a single CardFeatureEngine,
+    producing the same features without a full frame copy per stage. If cache_dir is given, the stateless feature
+    stages are wrapped in a FeatureCache there, reusing features across runs and CV folds
+    """
+    if fused:
+        return Pipeline([
+            ('CardFeatures', CardFeatureEngine(as_frame=True)),
+            (modelname, model)
+        ])
+
+    def cached(transformer):
+        return FeatureCache(transformer, cache_dir) if cache_dir else transformer
+
     pipe = Pipeline([
         ('BoolToInt', BoolTransformer()),
-        ('CreatureFeature', CreatureFeatureTransformer()),
-        ('Planeswalker', PlaneswalkerTransformer()),
-        ('AbilityCounts', AbilityCountsTransformer()),
+        ('CreatureFeature', cached(CreatureFeatureTransformer())),
+        ('Planeswalker', cached(PlaneswalkerTransformer())),
+        ('AbilityCounts', cached(AbilityCountsTransformer())),
         ('Fillna', FillnaTransformer()),
-        ('CostIntensity', CostIntensityTransformer()),
+        ('CostIntensity', cached(CostIntensityTransformer())),
         ('CreateDummies', CreateDummiesTransformer()),
         ('DummifyType', TypelineTransformer()),
         ('DummifyColorID', ColorIDTransformer()),
@@ -341,9 +365,14 @@ class BaselineModel(BaseEstimator, RegressorMixin):
         return -rmsle(y_pred, y)
 
 class SpotPriceGBR(BaseEstimator, RegressorMixin):
-    """ Model using only recent prices (done already; need to formalize)"""
-    def __init__(self, model=GradientBoostingRegressor(), base_weight=0, log_y=False):
+    """
+    Model using only recent prices (done already; need to formalize).
+    Setting backend fits make_gbr(backend, **backend_params) as model_ instead of model
+    """
+    def __init__(self, model=GradientBoostingRegressor(), base_weight=0, log_y=False, backend=None, backend_params=None):
         self.base_weight = base_weight
+        self.backend = backend
+        self.backend_params = backend_params
         self.model = model
         self.log_y = log_y
 
@@ -354,12 +383,13 @@ class SpotPriceGBR(BaseEstimator, RegressorMixin):
         if self.log_y:
             y = np.log(y)
 
-        self.model.fit(X, y)
+        self.model_ = boosting_model(self.model, self.backend, self.backend_params)
+        self.model_.fit(X, y)
         return self
 
     def predict(self, X):
         """ Set floor to GBR predictions """
-        y_pred = self.model.predict(X)
+        y_pred = self.model_.predict(X)
 
         if self.log_y:
             y_pred = np.exp(y_pred)
@@ -372,16 +402,50 @@ class SpotPriceGBR(BaseEstimator, RegressorMixin):
         y_pred = self.predict(X)
         return -rmsle(y_pred, y)
 
+def make_gbr(backend='exact', **params):
+    """
+    Returns a gradient boosting regressor for backend:
+        'exact': sklearn's GradientBoostingRegressor
+        'hist': HistGradientBoostingRegressor; binned, multithreaded, handles NaNs natively
+    """
+    if backend == 'exact':
+        return GradientBoostingRegressor(**params)
+    if backend == 'hist':
+        if HistGradientBoostingRegressor is None:
+            raise RuntimeError("HistGradientBoostingRegressor needs scikit-learn 0.21 or later")
+        return HistGradientBoostingRegressor(**params)
+    raise ValueError("backend must be 'exact' or 'hist', not {}".format(backend))
+
+def boosting_model(model, backend=None, backend_params=None):
+    """ Estimator a GBR model fits: model itself, or make_gbr(backend, **backend_params) when backend is set """
+    if backend:
+        return make_gbr(backend, **(backend_params or {}))
+    return model
+
+def _fit_rarity_model(model, X, y):
+    """ Fits a fresh clone of model; module level so joblib can ship it to worker processes """
+    return clone(model).fit(X, y)
+
+def _predict_rarity_model(model, X):
+    return model.predict(X)
+
 class SpotPriceByRarityGBR(BaseEstimator, RegressorMixin):
-    """ Model using only recent prices, fitting models by rarity"""
+    """
+    Model using only recent prices, fitting models by rarity. n_jobs fits & predicts rarity models in parallel.
+    Setting backend fits clones of make_gbr(backend, **backend_params) instead of model
+    """
     def __init__(self, model=GradientBoostingRegressor(), base_weight=0,
                  log_y=False, rarities=['mythic', 'rare', 'uncommon', 'common'],
-                 rarity_baseline={'mythic':10,'rare':1.5,'uncommon':0.5,'common':0.2}):
+                 rarity_baseline={'mythic':10,'rare':1.5,'uncommon':0.5,'common':0.2},
+                 n_jobs=1, backend=None, backend_params=None):
         self.base_weight = base_weight
+        self.backend = backend
+        self.backend_params = backend_params
         self.model = model
         self.log_y = log_y
         self.rarities = rarities
         self.rarity_baseline = rarity_baseline
+        self.n_jobs = n_jobs
         self.rarity_models_ = {}
 
     def fit(self, X_train, y_train):
@@ -394,12 +458,13 @@ class SpotPriceByRarityGBR(BaseEstimator, RegressorMixin):
             y = np.log(y)
         
         self.train_rarities_ = [x for x in X.columns if x.startswith('rarity_')]
+        model = boosting_model(self.model, self.backend, self.backend_params)
 
-        for rarity in self.train_rarities_:
-            train_mask = X[rarity]==1
-            rarity_model = clone(self.model)
-            rarity_model.fit(X[train_mask], y[train_mask])
-            self.rarity_models_[rarity] = rarity_model
+        # Results come back in rarity order whatever the worker count, so fits are deterministic given the model's random_state
+        train_masks = [X[rarity]==1 for rarity in self.train_rarities_]
+        rarity_models = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_rarity_model)(model, X[train_mask], y[train_mask]) for train_mask in train_masks)
+        self.rarity_models_ = dict(zip(self.train_rarities_, rarity_models))
         
         return self
 
@@ -413,15 +478,17 @@ class SpotPriceByRarityGBR(BaseEstimator, RegressorMixin):
         y_pred = np.ones(X.shape[0])
 
         test_rarities = [x for x in X.columns if x.startswith('rarity_')]
-
-        for rarity in test_rarities:
-            test_mask = X[rarity]==1
-            if test_mask.sum():
-                # If we have a rarity model, fit it; otherwise, use baseline assumption from init 
-                try:
-                    y_pred[test_mask] = self.rarity_models_[rarity].predict(X[test_mask])
-                except:        
-                    y_pred[test_mask] = self.rarity_baseline[rarity]
+        test_masks = {rarity: (X[rarity]==1).values for rarity in test_rarities}
+        test_masks = {rarity: mask for rarity, mask in test_masks.items() if mask.sum()}
+
+        # If we have a rarity model, predict with it; otherwise, use baseline assumption from init
+        modeled = [rarity for rarity in test_masks if rarity in self.rarity_models_]
+        rarity_preds = Parallel(n_jobs=self.n_jobs)(
+            delayed(_predict_rarity_model)(self.rarity_models_[rarity], X[test_masks[rarity]]) for rarity in modeled)
+        for rarity, preds in zip(modeled, rarity_preds):
+            y_pred[test_masks[rarity]] = preds
+        for rarity in set(test_masks) - set(modeled):
+            y_pred[test_masks[rarity]] = self.rarity_baseline[rarity[len('rarity_'):]]
 
         if self.log_y:
             y_pred = np.exp(y_pred)
@@ -436,11 +503,16 @@ class SpotPriceByRarityGBR(BaseEstimator, RegressorMixin):
         return -rmsle(y_pred, y)
 
 class StandardNormalizerGBR(BaseEstimator, RegressorMixin):
-    """ Uses price history of rarities across standard season to normalize power """
+    """
+    Uses price history of rarities across standard season to normalize power.
+    Setting backend fits make_gbr(backend, **backend_params) as model_ instead of model
+    """
     def __init__(self, model=GradientBoostingRegressor(), base_weight=0,
                  log_y=False, rarities=['mythic', 'rare', 'uncommon', 'common'],
-                 std_sets_df=None, next_sets=5):
+                 std_sets_df=None, next_sets=5, backend=None, backend_params=None):
         self.base_weight = base_weight
+        self.backend = backend
+        self.backend_params = backend_params
         self.model = model
         self.log_y = log_y
         self.rarities = rarities
@@ -504,7 +576,8 @@ class StandardNormalizerGBR(BaseEstimator, RegressorMixin):
         X = self._drop_seasons(X)
         X.drop(columns=['setname','rarity'], inplace=True)
         self.train_columns_ = list(X.columns)
-        self.model.fit(X, y_power)
+        self.model_ = boosting_model(self.model, self.backend, self.backend_params)
+        self.model_.fit(X, y_power)
         
         print("Done fitting GBR")
 
@@ -517,7 +590,7 @@ class StandardNormalizerGBR(BaseEstimator, RegressorMixin):
 
         # Predict with model
         print("Predicting power")
-        y_pred_power = self.model.predict(X.drop(columns=['setname','rarity']))
+        y_pred_power = self.model_.predict(X.drop(columns=['setname','rarity']))
 
         if self.log_y:
             y_pred_power = np.exp(y_pred_power)
@@ -1,62 +1,93 @@
 import numpy as np
 import pandas as pd
-import json, requests, pickle
+import json, requests, pickle, os, shutil
+from urllib.parse import quote
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter, MonthLocator
 import matplotlib.patheffects as pe
-from sqlalchemy import create_engine
-import psycopg2
+from sqlalchemy import text
+from scrape.mystic_db import connect_mystic, mystic_connection, prepare_statement
+from model.master_transmuter import StandardPriceTransformer
+# pyarrow is optional, only needed for the local parquet price history dataset
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 def get_recent_price(card_row, version=2):
     '''DEPRECATED'''
     # Card attributes on which to query
-    cardname = card_row['name'].replace("'","''")
-    setname = card_row['set_name'].replace("'","''")
+    cardname = card_row['name']
+    setname = card_row['set_name']
     rarity = card_row['rarity']
 
     # Structure query (with language)
     tablename = rarity+"_price_history_"+str(version)
-    connection = connect_mystic()
 
-    query = ("select ph.cardname, ph.setname, ph.timestamp, ph.price "
-             "from {0} ph, "
-             "     (select max(timestamp) as lastdate "
-             "      from {0} ph2 "
-             "      where ph2.cardname='{1}' and ph2.setname='{2}') mostrecent "
-             "where ph.timestamp = mostrecent.lastdate "
-             "and ph.cardname='{1}' and ph.setname='{2}' ").format(tablename, cardname, setname)
+    query = text("select ph.cardname, ph.setname, ph.timestamp, ph.price "
+                 "from {0} ph, "
+                 "     (select max(timestamp) as lastdate "
+                 "      from {0} ph2 "
+                 "      where ph2.cardname=:cardname and ph2.setname=:setname) mostrecent "
+                 "where ph.timestamp = mostrecent.lastdate "
+                 "and ph.cardname=:cardname and ph.setname=:setname ".format(tablename))
 
     # Do the thing
-    results = connection.execute(query)
-    connection.close()
+    with mystic_connection() as connection:
+        results = connection.execute(query, {'cardname': cardname, 'setname': setname}).fetchall()
     for r in results:
         print(r)
         print("loading {0}'s({1}) price = {2} at time {3} into dataframe".format(r[0], r[1], r[3], r[2]))
         return (r[2], r[3])
 
 def get_card_price_history(card_row, version=2):
-        # Card attributes on which to query
-    cardname = card_row['name'].replace("'","''")
-    setname = card_row['set_name'].replace("'","''")
-    rarity = card_row['rarity'] 
-    # Structure query (with language)
-    tablename = rarity+"_price_history_"+str(version)
-    connection = connect_mystic()
+    cardname = card_row['name']
+    setname = card_row['set_name']
+    price_history = get_cards_price_history(pd.DataFrame([card_row]), version)[(cardname, setname)]
+    print("loading {0}'s({1}) prices".format(cardname, setname))
+    return price_history
 
-    query = ("select ph.cardname, ph.setname, ph.timestamp, ph.price "
-             "from {0} ph "
-             "where ph.cardname='{1}' and ph.setname='{2}' ").format(tablename, cardname, setname)
+def get_cards_price_history(cards_df, version=2):
+    '''
+    Fetches price histories of many cards in one round trip, joining each rarity table against the cards of that rarity
+    Input:
+        cards_df: dataframe of cards, with name, set_name and rarity columns
+    Output:
+        Dictionary with (cardname, setname) keys, and lists of [time, price] in time order as values, like
+        get_card_price_history; cards without price history get an empty list
+    '''
+    price_histories = {(name, setname): [] for name, setname in cards_df[['name','set_name']].values}
+    if not price_histories:
+        return price_histories
+
+    selects = []
+    params = {}
+    for rarity, rarity_df in cards_df.groupby('rarity'):
+        tablename = rarity+"_price_history_"+str(version)
+        rows = []
+        for name, setname in rarity_df[['name','set_name']].drop_duplicates().values:
+            i = len(params)//2
+            params['cardname_{}'.format(i)] = name
+            params['setname_{}'.format(i)] = setname
+            rows.append("(:cardname_{0}, :setname_{0})".format(i))
+        cards = ", ".join(rows)
+        selects.append("select ph.cardname, ph.setname, ph.timestamp, ph.price "
+                       "from {0} ph "
+                       "join (values {1}) as cards (cardname, setname) "
+                       "  on ph.cardname = cards.cardname and ph.setname = cards.setname ".format(tablename, cards))
+    query = text("select * from ({}) histories "
+                 "order by cardname, setname, timestamp ".format("union all ".join(selects)))
 
     # Do the thing
-    results = connection.execute(query)
-    connection.close()
-    c=1000000
-    price_history = []
-    for r in results:
-        time = str(pd.Timestamp.utcfromtimestamp(int(r[2])/1000))
-        price_history.append([time,r[3]])
-    print("loading {0}'s({1}) prices".format(cardname, setname))
-    return price_history
+    with mystic_connection() as connection:
+        history_df = pd.read_sql(query, connection, params=params)
+
+    times = pd.to_datetime(history_df['timestamp'].astype(np.int64), unit='ms')
+    history_df['time'] = [str(time) for time in times]
+    for (cardname, setname), card_df in history_df.groupby(['cardname','setname'], sort=False):
+        price_histories[(cardname, setname)] = card_df[['time','price']].values.tolist()
+    return price_histories
 
 def fill_recent_prices(cards_df):
     '''DEPRECATED'''
@@ -64,183 +95,386 @@ def fill_recent_prices(cards_df):
     filled_df[['recent_date','recent_price']] = cards_df.apply(get_recent_price, axis=1).apply(pd.Series)
     return filled_df
 
-def get_recent_prices(rarity, version=2):
+def recent_prices_query(tablename, sample=None, seed=None):
+    """
+    Latest price of every card in a price history table, walking the (setname, cardname, timestamp) index once with
+    distinct on instead of joining the table to its own per card max(timestamp). With sample, only that many cards
+    are sent back, picked on the server at random, or repeatably by hashing the cards with seed.
+    """
+    query = ("select distinct on (setname, cardname) cardname, setname, timestamp, price "
+             "from {0} "
+             "order by setname desc, cardname desc, timestamp desc ").format(tablename)
+    params = {}
+    if sample is not None:
+        order = "md5(cardname || setname || :seed)" if seed is not None else "random()"
+        query = "select * from ({0}) latest order by {1} limit :sample ".format(query, order)
+        params = {'sample': int(sample), 'seed': str(seed)}
+    return text(query), params
+
+def get_recent_prices(rarity, version=2, sample=None, seed=None):
+    """ Latest price of every card of a rarity, or of a sample of them, see recent_prices_query """
     tablename = rarity+'_price_history_'+str(version)
-    connection = connect_mystic()
-
-    query = ("select ph.cardname, ph.setname, ph.timestamp, ph.price "
-            "from {0} ph, "
-            "     (select ph2.cardname, ph2.setname, max(timestamp) as lastdate "
-            "      from {0} ph2 "
-            "      group by ph2.cardname, ph2.setname) mr "
-            "where ph.timestamp = mr.lastdate "
-            "and ph.cardname = mr.cardname "
-            "and ph.setname = mr.setname ").format(tablename)
+    query, params = recent_prices_query(tablename, sample, seed)
 
     # Do the thing
-    recent_df = pd.read_sql(query, connection)
-    connection.close()
+    with mystic_connection() as connection:
+        recent_df = pd.read_sql(query, connection, params=params)
     return recent_df
 
-def get_price_history(rarity, version=2):
+def iter_recent_prices(rarity, version=2, chunksize=50000, sample=None, seed=None):
+    """ Same as get_recent_prices, yielding dataframes of up to chunksize cards read through a server side cursor """
+    tablename = rarity+'_price_history_'+str(version)
+    query, params = recent_prices_query(tablename, sample, seed)
+    with mystic_connection() as connection:
+        streaming = connection.execution_options(stream_results=True)
+        for recent_df in pd.read_sql(query, streaming, params=params, chunksize=chunksize):
+            yield recent_df
+
+def get_price_history(rarity, version=2, dataset=None):
+    """ Whole price history of a rarity, from the database, or from a local parquet dataset written by export_price_history """
+    if dataset is not None:
+        return read_price_history(dataset, rarities=[rarity])
+
     tablename = rarity+'_price_history_'+str(version)
-    connection = connect_mystic()
 
     query = ("select * from {} ").format(tablename)
 
     # Do the thing
-    price_history_df = pd.read_sql(query, connection)
-    connection.close()
+    with mystic_connection() as connection:
+        price_history_df = pd.read_sql(query, connection)
     return price_history_df
 
-def write_recent_prices(cards_df, rarities):
+def price_history_table(cardnames, timestamps, prices):
+    """ Arrow table of price history rows, with dictionary encoded card names, int64 ms timestamps and float32 prices """
+    return pa.table({'cardname': pa.array(cardnames, pa.string()).dictionary_encode(),
+                     'timestamp': pa.array(timestamps, pa.int64()),
+                     'price': pa.array(prices, pa.float32())})
+
+def export_price_history(rarities=['mythic','rare', 'uncommon', 'common'], version=2,
+                         dataset='data/price_history', chunksize=100000, row_group_size=20000):
+    """
+    Streams price history tables into a local parquet dataset partitioned by rarity & set (dataset/rarity=x/setname=y/),
+    reading through a server side cursor in chunks of rows so memory stays flat on the big tables.
+    Rows are written in time order within each set, in row groups of at most row_group_size rows, so each row group
+    covers its own stretch of time and reads filtered on timestamp skip the rest.
+    Each rarity's partition is rewritten from scratch.
+    """
+    if pa is None:
+        raise ImportError('export_price_history needs pyarrow')
+    for rarity in rarities:
+        tablename = rarity+'_price_history_'+str(version)
+        rarity_dir = os.path.join(dataset, 'rarity='+rarity)
+        if os.path.isdir(rarity_dir):
+            shutil.rmtree(rarity_dir)
+
+        # sorted by set, so only one set's file is open at a time, then by time, so row groups don't overlap in time
+        query = text("select cardname, setname, timestamp, price from {} "
+                     "order by setname, timestamp ".format(tablename))
+        writer = None
+        writer_set = None
+        rows = 0
+        with mystic_connection() as connection:
+            result = connection.execution_options(stream_results=True).execute(query)
+            for chunk in result.partitions(chunksize):
+                chunk_df = pd.DataFrame(chunk, columns=['cardname','setname','timestamp','price'])
+                for setname, set_df in chunk_df.groupby('setname', sort=False):
+                    if setname != writer_set:
+                        if writer is not None:
+                            writer.close()
+                        set_dir = os.path.join(rarity_dir, 'setname='+quote(setname, safe=' '))
+                        os.makedirs(set_dir)
+                        table = price_history_table(set_df['cardname'].values, set_df['timestamp'].values, set_df['price'].values)
+                        writer = pq.ParquetWriter(os.path.join(set_dir, 'part-0.parquet'), table.schema)
+                        writer_set = setname
+                    else:
+                        table = price_history_table(set_df['cardname'].values, set_df['timestamp'].values, set_df['price'].values)
+                    writer.write_table(table, row_group_size=row_group_size)
+                rows += chunk_df.shape[0]
+        if writer is not None:
+            writer.close()
+        print('exported {0} {1} price points to {2}'.format(rows, rarity, rarity_dir))
+
+def read_price_history(dataset='data/price_history', rarities=None, sets=None, since=None, until=None,
+                       columns=['cardname','setname','timestamp','price']):
+    """
+    Reads price history rows from a parquet dataset written by export_price_history. Only the partitions of the given
+    rarities & sets are opened, and row groups outside of [since, until] (ms timestamps) are skipped.
+    Card & set names come back as categoricals.
+    """
+    if pa is None:
+        raise ImportError('read_price_history needs pyarrow')
+    filters = []
+    if rarities is not None:
+        filters.append(('rarity', 'in', list(rarities)))
+    if sets is not None:
+        filters.append(('setname', 'in', list(sets)))
+    if since is not None:
+        filters.append(('timestamp', '>=', since))
+    if until is not None:
+        filters.append(('timestamp', '<=', until))
+    table = pq.read_table(dataset, columns=columns, filters=filters or None, partitioning='hive')
+    return table.to_pandas()
+
+def write_recent_prices(cards_df, rarities, chunksize=50000):
     # UNTESTED
     for rarity in rarities:
         print('writing {} prices to csv'.format(rarity))
-        filled_df = get_recent_prices(rarity)
-        merged = cards_df.merge(filled_df, on=['cardname','setname'])
-        merged.to_csv(path_or_buf='data/all_vintage_cards-{}_recent.csv'.format(rarity))
-
-def avg_price_by_season(seasons, tablename):
+        # merge & write a chunk of cards at a time
+        written = 0
+        for filled_df in iter_recent_prices(rarity, chunksize=chunksize):
+            merged = cards_df.merge(filled_df, on=['cardname','setname'])
+            merged.index += written
+            merged.to_csv(path_or_buf='data/all_vintage_cards-{}_recent.csv'.format(rarity),
+                          mode='a' if written else 'w', header=not written)
+            written += merged.shape[0]
+
+def season_bounds(seasons):
+    """ Converts season_dates rows of [begin_date, end_date, season] to arrays of season numbers, start & end in ms """
     c=1000000
-    print(c)
-    connection = connect_mystic()
-    seasons_df = pd.DataFrame(columns=['cardname','setname'])
-    for season in seasons:
-        # to timestamp
-        start = str(int(pd.Timestamp(season[0]).value/c))
-        end = str(int(pd.Timestamp(season[1]).value/c))
-        query = ("select cardname, setname, avg(price) as s{3} "
-                 "from {0} "
-                 "where cast(timestamp as float) > {1} and cast(timestamp as float) < {2} "
-                 "group by cardname, setname ").format(tablename,start,end,season[2])
-        season_df = pd.read_sql(query, connection)
-        seasons_df = seasons_df.merge(season_df, on=['cardname','setname'], how='outer')
-    connection.close()
-    return seasons_df
+    numbers = np.array([int(season[2]) for season in seasons], dtype=np.int64)
+    starts = np.array([int(pd.Timestamp(season[0]).value/c) for season in seasons], dtype=np.int64)
+    ends = np.array([int(pd.Timestamp(season[1]).value/c) for season in seasons], dtype=np.int64)
+    return numbers, starts, ends
+
+def season_values(seasons):
+    """ Formats season_dates rows of [begin_date, end_date, season] as a SQL VALUES list of (season, start, end) in ms """
+    rows = ["({0}, {1}, {2})".format(*bounds) for bounds in zip(*season_bounds(seasons))]
+    return ", ".join(rows)
+
+def seasons_to_wide(long_df, seasons):
+    """ Pivots long (cardname, setname, season, price) results into one s<season> column per season """
+    wide_df = long_df.set_index(['cardname','setname','season'])['price'].unstack('season')
+    wide_df = wide_df.reindex(columns=[int(season[2]) for season in seasons])
+    wide_df.columns = ['s{}'.format(season) for season in wide_df.columns]
+    return wide_df.reset_index()
+
+def avg_price_by_season(seasons, tablename, wide=True):
+    """ Average price of every card in every season, in one query joining the price table against all seasons """
+    query = ("with seasons (season, s_start, s_end) as (values {SEASONS}) "
+             "select ph.cardname, ph.setname, s.season, avg(ph.price) as price "
+             "from {TABLENAME} ph "
+             "join seasons s "
+             "  on ph.timestamp > s.s_start and ph.timestamp < s.s_end "
+             "group by ph.cardname, ph.setname, s.season ").format(SEASONS=season_values(seasons), TABLENAME=tablename)
+    with mystic_connection() as connection:
+        seasons_df = pd.read_sql(query, connection)
+    return seasons_to_wide(seasons_df, seasons) if wide else seasons_df
 
 def get_twavg_card(cardname, setname, seasons, tablename):
     c=1000000
+    # add season bookends to price history, calculate leads and diffs
+    # prepared once per pooled connection, taking $1 cardname, $2 setname, $3 season start & $4 end, so every
+    # card and season after the first executes the cached plan
+    statement = ("with test_card as "
+                 "(select * from {TABLENAME} "
+                 "where cardname=$1 "
+                 "  and setname=$2) "
+                 " "
+                 ",add_season_bookends as "
+                 "(select ph.cardname, ph.setname, cast($3 as bigint) as timestamp, ph.price "
+                 "from test_card ph, "
+                 "     (select ph2.cardname, ph2.setname, max(ph2.timestamp) as lastdate "
+                 "      from test_card ph2 "
+                 "      where ph2.timestamp < $3 "
+                 "      group by ph2.cardname, ph2.setname) ss "
+                 "where ph.timestamp = ss.lastdate "
+                 "union "
+                 "select ph.cardname, ph.setname, cast($4 as bigint) as timestamp, ph.price "
+                 "from test_card ph, "
+                 "     (select ph2.cardname, ph2.setname, max(ph2.timestamp) as lastdate "
+                 "      from test_card ph2 "
+                 "      where ph2.timestamp < $4 "
+                 "      group by ph2.cardname, ph2.setname) ss "
+                 "where ph.timestamp = ss.lastdate "
+                 "union "
+                 "select cardname, setname, timestamp, price "
+                 "from test_card "
+                 "where timestamp >= $3 "
+                 "  and timestamp <= $4) "
+                 " "
+                 ",leads as "
+                 "(select *, lead(timestamp) over (partition by cardname, setname order by timestamp) timelead, "
+                 "           lead(price) over (partition by cardname, setname order by timestamp) pricelead "
+                 "from add_season_bookends) "
+                 " "
+                 ",diffs as "
+                 "(select *, date_part('day', to_timestamp(timelead) - to_timestamp(timestamp)) as daydiff "
+                 "from leads) "
+                 " "
+                 "select cardname, setname, sum(daydiff*(price+pricelead)/2)/sum(daydiff) as price "
+                 "from diffs "
+                 "group by cardname, setname ").format(TABLENAME=tablename)
+
+    name = 'twavg_card_' + tablename
+    query = text("EXECUTE {}(:cardname, :setname, :start, :end)".format(name))
     connection = connect_mystic()
+    prepare_statement(connection, name, statement, ['text', 'text', 'bigint', 'bigint'])
     seasons_df = pd.DataFrame(columns=['cardname','setname'])
     for season in seasons:
         # to timestamp
-        start = str(int(pd.Timestamp(season[0]).value/c))
-        end = str(int(pd.Timestamp(season[1]).value/c))
-
-        # add season bookends to price history, calculate leads and diffs
-        query = ("with test_card as "
-                "(select * from {TABLENAME} "
-                "where cardname=\'{CARDNAME}\' "
-                "  and setname=\'{SETNAME}\') "
-                " "
-                ",add_season_bookends as "
-                "(select ph.cardname, ph.setname, '{START}' as timestamp, ph.price "
-                "from test_card ph, "
-                "     (select ph2.cardname, ph2.setname, max(ph2.timestamp) as lastdate "
-                "      from test_card ph2 "
-                "      where cast(ph2.timestamp as float) < {START} "
-                "      group by ph2.cardname, ph2.setname) ss "
-                "where ph.timestamp = ss.lastdate "
-                "union "
-                "select ph.cardname, ph.setname, '{END}' as timestamp, ph.price "
-                "from test_card ph, "
-                "     (select ph2.cardname, ph2.setname, max(ph2.timestamp) as lastdate "
-                "      from test_card ph2 "
-                "      where cast(ph2.timestamp as float) < {END} "
-                "      group by ph2.cardname, ph2.setname) ss "
-                "where ph.timestamp = ss.lastdate "
-                "union "
-                "select cardname, setname, timestamp, price "
-                "from test_card "
-                "where cast(timestamp as float) >= {START} "
-                "  and cast(timestamp as float) <= {END}) "             
-                " "
-                ",leads as "
-                "(select *, lead(timestamp) over (partition by cardname, setname order by timestamp) timelead, "
-                "           lead(price) over (partition by cardname, setname order by timestamp) pricelead "
-                "from add_season_bookends) "
-                " "
-                ",diffs as "
-                "(select *, date_part('day', to_timestamp(cast(timelead as float)) - to_timestamp(cast(timestamp as float))) as daydiff "
-                "from leads) "
-                " "
-                "select cardname, setname, sum(daydiff*(price+pricelead)/2)/sum(daydiff) as s{SEASON} "
-                "from diffs "
-                "group by cardname, setname ").format(START=start,
-                                                      END=end,
-                                                      TABLENAME=tablename,
-                                                      CARDNAME=cardname,
-                                                      SETNAME=setname,
-                                                      SEASON=season[2])
-        season_df = pd.read_sql(query, connection)
+        params = {'cardname': cardname,
+                  'setname': setname,
+                  'start': int(pd.Timestamp(season[0]).value/c),
+                  'end': int(pd.Timestamp(season[1]).value/c)}
+        season_df = pd.read_sql(query, connection, params=params)
+        season_df = season_df.rename(columns={'price': 's{}'.format(season[2])})
         seasons_df = seasons_df.merge(season_df, on=['cardname','setname'], how='outer')
+    connection.close()
 
     return seasons_df    
 
-def w_avg_price_by_season(seasons, tablename):
-    c=1000000
-    connection = connect_mystic()
-    seasons_df = pd.DataFrame(columns=['cardname','setname'])
-    for season in seasons:
-        # to timestamp
-        start = str(int(pd.Timestamp(season[0]).value/c))
-        end = str(int(pd.Timestamp(season[1]).value/c))
-
-        # add season bookends to price history, calculate leads and diffs
-        query = ("with add_season_bookends as "
-                "(select ph.cardname, ph.setname, '{START}' as timestamp, ph.price "
-                "from {TABLENAME} ph, "
-                "     (select ph2.cardname, ph2.setname, max(ph2.timestamp) as lastdate "
-                "      from {TABLENAME} ph2 "
-                "      where cast(ph2.timestamp as float) < {START} "
-                "      group by ph2.cardname, ph2.setname) ss "
-                "where ph.timestamp = ss.lastdate "
-                "  and ph.cardname = ss.cardname "
-                "  and ph.setname = ss.setname "
-                "union "
-                "select ph.cardname, ph.setname, '{END}' as timestamp, ph.price "
-                "from {TABLENAME} ph, "
-                "     (select ph2.cardname, ph2.setname, max(ph2.timestamp) as lastdate "
-                "      from {TABLENAME} ph2 "
-                "      where cast(ph2.timestamp as float) < {END} "
-                "      group by ph2.cardname, ph2.setname) ss "
-                "where ph.timestamp = ss.lastdate "
-                "  and ph.cardname = ss.cardname "
-                "  and ph.setname = ss.setname "
-                "union "
-                "select cardname, setname, timestamp, price "
-                "from {TABLENAME} "
-                "where cast(timestamp as float) >= {START} "
-                "  and cast(timestamp as float) <= {END}) "
-                " "
-                ",leads as "
-                "(select *, lead(timestamp) over (partition by cardname, setname order by timestamp) timelead, "
-                "           lead(price) over (partition by cardname, setname order by timestamp) pricelead "
-                "from add_season_bookends) "
-                " "
-                ",diffs as "
-                "(select *, date_part('day', to_timestamp(cast(timelead as float)) - to_timestamp(cast(timestamp as float))) as daydiff "
-                "from leads) "
-                " "
-                "select cardname, setname, sum(daydiff*(price+pricelead)/2)/sum(daydiff) as s{SEASON} "
-                "from diffs "
-                "group by cardname, setname ").format(START=start, END=end, TABLENAME=tablename, SEASON=season[2])
-        season_df = pd.read_sql(query, connection)
-        seasons_df = seasons_df.merge(season_df, on=['cardname','setname'], how='outer')
-
-    return seasons_df
+def w_avg_price_by_season(seasons, tablename, wide=True):
+    """
+    Time weighted (trapezoidal) average price of every card in every season, in one scan of the price table.
+    Each season gets bookends at its start & end carrying the last price before them, found by carrying prices
+    forward over the merged stream of price points and bookend markers. Bookends sort before a point on the same
+    bound (kind 0 before 1), so a point exactly on a season bound is ordered the same way every time.
+    """
+    # add season bookends to price history, calculate leads and diffs
+    query = ("with seasons (season, s_start, s_end) as (values {SEASONS}) "
+            " "
+            ",points as "
+            "(select cardname, setname, timestamp as ts, price "
+            "from {TABLENAME}) "
+            " "
+            ",bounds as "
+            "(select season, s_start as bound from seasons "
+            "union all "
+            "select season, s_end as bound from seasons) "
+            " "
+            ",events as "
+            "(select cardname, setname, ts, 1 as kind, price, null::int as season "
+            "from points "
+            "union all "
+            "select c.cardname, c.setname, b.bound, 0, null, b.season "
+            "from (select distinct cardname, setname from points) c, bounds b) "
+            " "
+            ",carried as "
+            "(select *, count(price) over (partition by cardname, setname order by ts, kind) as grp "
+            "from events) "
+            " "
+            ",bookends as "
+            "(select *, first_value(price) over (partition by cardname, setname, grp order by ts, kind) as lastprice "
+            "from carried) "
+            " "
+            ",add_season_bookends as "
+            "(select cardname, setname, season, ts, kind, lastprice as price "
+            "from bookends "
+            "where kind = 0 and lastprice is not null "
+            "union "
+            "select p.cardname, p.setname, s.season, p.ts, 1, p.price "
+            "from points p "
+            "join seasons s on p.ts >= s.s_start and p.ts <= s.s_end) "
+            " "
+            ",leads as "
+            "(select *, lead(ts) over (partition by cardname, setname, season order by ts, kind) timelead, "
+            "           lead(price) over (partition by cardname, setname, season order by ts, kind) pricelead "
+            "from add_season_bookends) "
+            " "
+            ",diffs as "
+            "(select *, date_part('day', to_timestamp(timelead) - to_timestamp(ts)) as daydiff "
+            "from leads) "
+            " "
+            "select cardname, setname, season, sum(daydiff*(price+pricelead)/2)/nullif(sum(daydiff), 0) as price "
+            "from diffs "
+            "group by cardname, setname, season ").format(SEASONS=season_values(seasons), TABLENAME=tablename)
+    with mystic_connection() as connection:
+        seasons_df = pd.read_sql(query, connection)
+    return seasons_to_wide(seasons_df, seasons) if wide else seasons_df
+
+def twavg_by_season(card_ids, timestamps, prices, starts, ends):
+    """
+    In-memory equivalent of w_avg_price_by_season's SQL: time weighted (trapezoidal) average price per card per season.
+    Input:
+        card_ids, timestamps (ms), prices: arrays sorted by (card_id, timestamp), card_ids numbered 0 to n_cards-1
+        starts, ends: arrays of season bounds in ms
+    Output:
+        averages: n_cards x n_seasons array, NaN where a card-season has no weighted span
+        exists: n_cards x n_seasons bool array, True where the SQL would return a row for the card-season
+    """
+    card_ids = np.asarray(card_ids, dtype=np.int64)
+    t = np.asarray(timestamps, dtype=np.int64)
+    p = np.asarray(prices, dtype=np.float64)
+    starts = np.asarray(starts, dtype=np.int64)[None, :]
+    ends = np.asarray(ends, dtype=np.int64)[None, :]
+    n_cards = int(card_ids.max()) + 1 if card_ids.shape[0] else 0
+    n_seasons = starts.shape[1]
+    if not n_cards:
+        return np.full((0, n_seasons), np.nan), np.zeros((0, n_seasons), dtype=bool)
+    # Matches date_part('day', to_timestamp(ms) - to_timestamp(ms)) in the SQL
+    day = 86400
+
+    # Prefix sums of the trapezoids between consecutive points (only differences within a card are used)
+    seg_days = (t[1:] - t[:-1]) // day
+    seg_weights = seg_days * (p[1:] + p[:-1]) / 2
+    cum_days = np.concatenate([[0], np.cumsum(seg_days)])
+    cum_weights = np.concatenate([[0.0], np.cumsum(seg_weights)])
+
+    # Find season bookends with searchsorted over a (card, timestamp) composite key
+    origin = min(t.min(), starts.min()) - 1
+    span = max(t.max(), ends.max()) - origin + 1
+    keys = card_ids*span + (t - origin)
+    cards = np.arange(n_cards, dtype=np.int64)[:, None]
+    lo = np.searchsorted(card_ids, cards, side='left')
+    a = np.searchsorted(keys, cards*span + (starts - origin), side='left')   # first point >= start
+    e = np.searchsorted(keys, cards*span + (ends - origin), side='left')     # first point >= end
+    b = np.searchsorted(keys, cards*span + (ends - origin), side='right')    # first point > end
+
+    has_start = a > lo      # a price before the season start to bookend it with
+    has_end = e > lo        # a price before the season end to bookend it with
+    exists = has_end | (b > a)
+
+    last = len(t) - 1
+    t_a, p_a = t[np.minimum(a, last)], p[np.minimum(a, last)]
+    p_before_a = p[np.clip(a-1, 0, last)]
+    t_before_e, p_before_e = t[np.clip(e-1, 0, last)], p[np.clip(e-1, 0, last)]
+
+    # Segments between points within [start, end)
+    inner = e-1 > a
+    days = np.where(inner, cum_days[np.clip(e-1, 0, last)] - cum_days[np.minimum(a, last)], 0)
+    weights = np.where(inner, cum_weights[np.clip(e-1, 0, last)] - cum_weights[np.minimum(a, last)], 0.0)
+
+    # Start bookend to first point in season
+    opening = has_start & (e > a)
+    start_days = np.where(opening, (t_a - starts) // day, 0)
+    days = days + start_days
+    weights = weights + np.where(opening, start_days*(p_before_a + p_a)/2, 0.0)
+
+    # Last point (or start bookend) to end bookend, which carries the last price before the end
+    t_last = np.where(e-1 >= a, t_before_e, starts)
+    end_days = np.where(has_end, (ends - t_last) // day, 0)
+    days = days + end_days
+    weights = weights + np.where(has_end, end_days*p_before_e, 0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = np.where(days > 0, weights/np.where(days > 0, days, 1), np.nan)
+    return averages, exists
+
+def local_w_avg_price_by_season(price_history_df, seasons, wide=True):
+    """
+    Same output as w_avg_price_by_season, computed in memory from a price history dump
+    (cardname, setname, timestamp, price rows, eg from get_price_history or read_price_history) instead of the database
+    """
+    history = price_history_df[['cardname','setname','timestamp','price']].copy()
+    history['timestamp'] = pd.to_numeric(history['timestamp']).astype(np.int64)
+    history['card_id'] = history.groupby(['cardname','setname'], observed=True).ngroup()
+    history.sort_values(['card_id','timestamp'], kind='mergesort', inplace=True)
+
+    numbers, starts, ends = season_bounds(seasons)
+    averages, exists = twavg_by_season(history['card_id'].values, history['timestamp'].values,
+                                       history['price'].values, starts, ends)
+
+    cards = history.drop_duplicates('card_id')[['cardname','setname']].values
+    card_idx, season_idx = np.nonzero(exists)
+    seasons_df = pd.DataFrame({'cardname': cards[card_idx, 0],
+                               'setname': cards[card_idx, 1],
+                               'season': numbers[season_idx],
+                               'price': averages[card_idx, season_idx]})
+    return seasons_to_wide(seasons_df, seasons) if wide else seasons_df
 
 def get_standard_prices(rarity, std_sets):
     seasonal_prices = pd.read_csv('data/clean_cards-{}_seasonal_avg.csv'.format(rarity))
-    seasons = set(seasonal_prices.columns) and set(std_sets.columns)
-
-    def standard_mask(row):
-        for season in seasons:
-            row[season] = row[season]*std_sets.loc[row['setname']][season]
-        return row
-
-    return seasonal_prices.apply(standard_mask, axis=1)
+    return StandardPriceTransformer(std_sets).transform(seasonal_prices)
 
 def month_formatter(ax):
     months = MonthLocator(range(1, 13), bymonthday=1, interval=3)
@@ -405,28 +639,6 @@ def clean_seasonal_price_outliers(rarities = ['mythic','rare', 'uncommon', 'comm
         cards_df.reset_index(inplace=True)
         cards_df.to_csv('data/clean_cards-{}_seasonal_avg.csv'.format(rarity),index=False)
 
-def connect_mystic():
-    '''
-    Connects to mystic-speculation database, returns connection object
-    Output:
-        SqlAlchemy PostgreSQL connection object to mystic speculation database
-    '''
-    # Define database info
-    hostname = 'mystic-speculation.cwxojtlggspu.us-east-1.rds.amazonaws.com'
-    port = '5432'
-    dbname = 'mystic_speculation'
-
-    # load username and pw information for database
-    with open('scrape/login.txt', 'r') as login_info:
-        username = login_info.readline().strip()
-        password = login_info.readline().strip()
-
-    # connect to database with sqlalchemy engine
-    db_string = 'postgres://{0}:{1}@{2}:{3}/{4}'.format(username, password, hostname, port, dbname)
-    engine = create_engine(db_string)
-    connection = engine.connect()
-    return connection
-
 # TODO: merge prices + feature data and write to file
 def write_seasonal_averages(rarities):
     cards_df = pd.read_csv('data/all_vintage_cards.csv')
@@ -493,19 +705,17 @@ def get_craigs_picks():
             ]
     
     all_cards_df = pd.read_csv('data/all_vintage_cards.csv', low_memory=False)
-    picks_df = pd.DataFrame()
+    # find cards in all cards data, get rows
+    cardrows = []
     for card in cards:
-        cardname = card[0]
-        print("trying {}".format(cardname))
-        # find card in all cards data, get row
-        mask = (all_cards_df['name']==cardname) & (all_cards_df['set_name']==setname)
-
-        cardname = cardname.split('/')[0]
+        mask = (all_cards_df['name']==card[0]) & (all_cards_df['set_name']==setname)
+        cardrows.append(all_cards_df[mask].iloc[0])
+    # get all card price histories in one go
+    price_histories = get_cards_price_history(pd.DataFrame(cardrows))
 
-        cardrow = all_cards_df[mask].iloc[0]
-        # get card price history 
-        price_history = get_card_price_history(cardrow)
-        # convert dates and plot 
+    picks_df = pd.DataFrame()
+    for card, cardrow in zip(cards, cardrows):
+        price_history = price_histories[(cardrow['name'], setname)]
 
         # store prices just before and after prediction into dataframe 
         if len(price_history):
@@ -0,0 +1,210 @@
+import asyncio, time, random, os, json, gzip, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+# aiohttp is optional: without it (or with an HTTPCache), blocking requests.get calls are run on a thread pool
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Status codes worth retrying: rate limited, or the server having a bad moment
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class RetryableStatus(Exception):
+    ''' Raised for responses with a status in RETRY_STATUSES, so they get retried like connection errors '''
+    def __init__(self, url, status):
+        super().__init__('{0} returned {1}'.format(url, status))
+        self.status = status
+
+# Errors worth retrying: the connection failing or timing out, and RETRY_STATUSES. Anything else (eg a CacheMiss
+# or a bad url) would fail the same way again, so it's given up on at once
+TRANSIENT_ERRORS = (RetryableStatus, requests.ConnectionError, requests.Timeout, ConnectionError, asyncio.TimeoutError)
+if aiohttp is not None:
+    TRANSIENT_ERRORS += (aiohttp.ClientConnectionError,)
+
+class TokenBucket:
+    '''
+    Token bucket rate limiter: allows bursts of up to capacity requests, refilling at rate tokens per second.
+    It runs on a lock and the clock rather than an event loop, so one bucket can pace several fetch_all calls
+    (each under its own asyncio.run) and threads.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        ''' Takes a token, going into debt if there are none, and returns the seconds to wait before using it '''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens/self.rate)
+
+    async def acquire(self):
+        await asyncio.sleep(self.reserve())
+
+def rate_limiter(rate):
+    '''
+    TokenBucket limiting requests to rate per second, or None for no limit. A TokenBucket is passed through as is,
+    so one limiter can be shared by every fetch of a scrape run.
+    '''
+    if rate is None or isinstance(rate, TokenBucket):
+        return rate
+    return TokenBucket(rate) if rate else None
+
+class CacheMiss(Exception):
+    ''' Raised by an offline HTTPCache for urls it has no copy of '''
+
+class HTTPCache:
+    '''
+    On-disk HTTP response cache keyed by url: stores each 200 response gzipped, with its ETag and Last-Modified,
+    and revalidates with conditional GETs so unchanged pages come back as bodiless 304s.
+    Input:
+        cache_dir: directory of cached responses
+        max_age: seconds a cached response is replayed without revalidating, None to always revalidate
+        offline: replay from disk only, raising CacheMiss for urls not cached
+    '''
+    def __init__(self, cache_dir='data/http_cache', max_age=None, offline=False):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.offline = offline
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key+'.json'), os.path.join(self.cache_dir, key+'.gz')
+
+    def load(self, url):
+        ''' Cached (metadata, body) of url, or None '''
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+            with gzip.open(body_path, 'rb') as body_file:
+                return meta, body_file.read()
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        # write then rename, so concurrent readers never see half a file
+        tmp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+    def store(self, url, body, etag=None, last_modified=None):
+        ''' Caches body of url, or just marks the cached body as fresh when body is None '''
+        meta_path, body_path = self._paths(url)
+        if body is not None:
+            self._write(body_path, gzip.compress(body))
+        meta = {'url': url, 'etag': etag, 'last_modified': last_modified, 'fetched': time.time()}
+        self._write(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def get(self, url, timeout=30):
+        ''' Body of url, from disk when cached and still valid, otherwise from the server '''
+        cached = self.load(url)
+        if self.offline:
+            if cached is None:
+                raise CacheMiss(url)
+            return cached[1]
+        headers = {}
+        if cached is not None:
+            meta, body = cached
+            if self.max_age is not None and time.time() - meta['fetched'] < self.max_age:
+                return body
+            if meta['etag']:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = requests.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            self.store(url, None, meta['etag'], meta['last_modified'])
+            return body
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableStatus(url, response.status_code)
+        if response.status_code == 200:
+            self.store(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.content
+
+def http_get(url, cache=None, timeout=30):
+    ''' Body of url, through cache if given '''
+    if cache is not None:
+        return cache.get(url, timeout)
+    return requests.get(url, timeout=timeout).content
+
+def _requests_get(url, timeout, cache=None):
+    if cache is not None:
+        return cache.get(url, timeout)
+    response = requests.get(url, timeout=timeout)
+    if response.status_code in RETRY_STATUSES:
+        raise RetryableStatus(url, response.status_code)
+    return response.content
+
+async def _aiohttp_get(session, url):
+    async with session.get(url) as response:
+        if response.status in RETRY_STATUSES:
+            raise RetryableStatus(url, response.status)
+        return await response.read()
+
+async def fetch_all(urls, concurrency=8, rate=None, retries=3, backoff=1.0, timeout=30, on_result=None, cache=None):
+    '''
+    Fetches urls concurrently, with at most concurrency requests in flight and at most rate requests per second.
+    rate can also be a TokenBucket (see rate_limiter), to keep to one rate over several calls.
+    Failed requests (TRANSIENT_ERRORS: connection errors, timeouts, RETRY_STATUSES) are retried up to retries
+    times, with jittered exponential backoff starting at backoff seconds; other errors aren't retried.
+    Input:
+        urls: list of urls
+        on_result: optional callback(i, result), called as each url finishes
+        cache: optional HTTPCache to replay and revalidate responses through
+    Output:
+        list aligned with urls, of response bodies (bytes), or the exception of the last failed attempt
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = rate_limiter(rate)
+    loop = asyncio.get_running_loop()
+
+    async def fetch(i, url, get):
+        for attempt in range(retries + 1):
+            try:
+                async with semaphore:
+                    if bucket is not None:
+                        await bucket.acquire()
+                    result = await get(url)
+                break
+            except TRANSIENT_ERRORS as error:
+                result = error
+                if attempt < retries:
+                    await asyncio.sleep(backoff * 2**attempt * (0.5 + random.random()))
+            except Exception as error:
+                result = error
+                break
+        if on_result is not None:
+            on_result(i, result)
+        return result
+
+    if aiohttp is not None and cache is None:
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        async with aiohttp.ClientSession(timeout=client_timeout) as session:
+            get = lambda url: _aiohttp_get(session, url)
+            return await asyncio.gather(*[fetch(i, url, get) for i, url in enumerate(urls)])
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        get = lambda url: loop.run_in_executor(executor, _requests_get, url, timeout, cache)
+        return await asyncio.gather(*[fetch(i, url, get) for i, url in enumerate(urls)])
+
+def fetch_pages(urls, **kwargs):
+    '''
+    Blocking wrapper around fetch_all, taking the same keyword arguments. Called from inside a running event loop
+    (eg a Jupyter notebook), where asyncio.run isn't allowed, it runs fetch_all on a worker thread with its own loop.
+    '''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(fetch_all(urls, **kwargs))
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, fetch_all(urls, **kwargs)).result()
@@ -0,0 +1,198 @@
+import os, pickle, sqlite3, time
+from contextlib import contextmanager
+import multiprocessing
+from collections import defaultdict
+import pandas as pd
+from scrape.scraper import scrape_set_price_history, set_price_rows, MTGPRICE_RATE
+from scrape.fetch import TokenBucket, rate_limiter
+from scrape.mystic_db import mystic_connection, create_price_history_table, copy_rows, dispose_engine
+
+STATUSES = ['pending', 'running', 'done', 'failed']
+
+class ScrapeJobStore:
+    '''
+    Local SQLite store of scrape job state, one row per (rarity, set, card) with its status, number of attempts
+    and when it was last scraped. Pending cards are handed out a set at a time, so it doubles as the work queue
+    shared by scrape worker processes.
+    '''
+    def __init__(self, path='data/scrape_state.db'):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs "
+                               "(rarity text, setname text, cardname text, "
+                               " status text default 'pending', attempts integer default 0, "
+                               " last_scraped real, worker text, error text, "
+                               " primary key (rarity, setname, cardname))")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status)")
+
+    def _open(self):
+        # long timeout, since workers take turns writing
+        return sqlite3.connect(self.path, timeout=60)
+
+    @contextmanager
+    def _connect(self):
+        ''' Connection that commits on success and is closed either way '''
+        connection = self._open()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add_cards(self, cards_df, rarities):
+        ''' Adds a pending job for each card of the given rarities in cards_df (name, set_name, rarity); known cards are kept as they are '''
+        cards = cards_df[cards_df['rarity'].isin(rarities)][['rarity','set_name','name']].drop_duplicates()
+        with self._connect() as connection:
+            connection.executemany("INSERT OR IGNORE INTO jobs (rarity, setname, cardname) values (?, ?, ?)",
+                                   cards.values.tolist())
+
+    def reset_running(self):
+        ''' Puts cards left running by workers that died back in the queue '''
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET status = 'pending', worker = null WHERE status = 'running'")
+
+    def retry_failed(self):
+        ''' Puts failed cards back in the queue '''
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET status = 'pending' WHERE status = 'failed'")
+
+    def refresh(self, before):
+        ''' Puts cards done before a time (unix seconds) back in the queue, to pick up their newer prices '''
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET status = 'pending' WHERE status = 'done' AND last_scraped < ?", (before,))
+
+    def claim_set(self, worker):
+        '''
+        Claims the pending cards of the next set (in the order they were added) for a worker
+        Output:
+            (rarity, setname, list of cardnames), or None when there's nothing left to do
+        '''
+        connection = self._open()
+        try:
+            # take the write lock before looking, so two workers can't claim the same set
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT rarity, setname FROM jobs WHERE status = 'pending' "
+                                     "ORDER BY rowid LIMIT 1").fetchone()
+            if row is None:
+                connection.rollback()
+                return None
+            rarity, setname = row
+            cards = [r[0] for r in connection.execute("SELECT cardname FROM jobs WHERE status = 'pending' "
+                                                      "AND rarity = ? AND setname = ? ORDER BY rowid", row)]
+            connection.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1 "
+                               "WHERE status = 'pending' AND rarity = ? AND setname = ?", (worker, rarity, setname))
+            connection.commit()
+            return rarity, setname, cards
+        finally:
+            connection.close()
+
+    def finish(self, rarity, setname, done, failed, error=None):
+        ''' Records the outcome of a claimed set: cards done and cards failed '''
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany("UPDATE jobs SET status = 'done', last_scraped = ?, error = null "
+                                   "WHERE rarity = ? AND setname = ? AND cardname = ?",
+                                   [(now, rarity, setname, cardname) for cardname in done])
+            connection.executemany("UPDATE jobs SET status = 'failed', last_scraped = ?, error = ? "
+                                   "WHERE rarity = ? AND setname = ? AND cardname = ?",
+                                   [(now, error, rarity, setname, cardname) for cardname in failed])
+
+    def progress(self):
+        ''' Number of cards in each status, by rarity '''
+        with self._connect() as connection:
+            counts_df = pd.read_sql("SELECT rarity, status, count(*) as cards FROM jobs GROUP BY rarity, status", connection)
+        return counts_df.pivot(index='rarity', columns='status', values='cards').reindex(columns=STATUSES).fillna(0).astype(int)
+
+    def fail_dict(self, rarity):
+        ''' Dictionary of failed cards and their sets, like record_sets_price_history returns '''
+        fail_dict = defaultdict(set)
+        with self._connect() as connection:
+            for setname, cardname in connection.execute("SELECT setname, cardname FROM jobs "
+                                                        "WHERE status = 'failed' AND rarity = ?", (rarity,)):
+                fail_dict[setname].add(cardname)
+        return fail_dict
+
+def scrape_worker(state_path, version, incremental, scrape_kwargs):
+    '''
+    Works through the job store queue a set at a time until it's empty: scrapes the set's pending cards,
+    records their price histories into the rarity's table in one transaction, and marks each card done or failed
+    '''
+    store = ScrapeJobStore(state_path)
+    worker = '{0}:{1}'.format(os.uname()[1], os.getpid())
+    # one limiter paces all of the worker's sets
+    scrape_kwargs = dict(scrape_kwargs, rate=rate_limiter(scrape_kwargs.get('rate', MTGPRICE_RATE)))
+    while True:
+        claim = store.claim_set(worker)
+        if claim is None:
+            return
+        rarity, setname, cards = claim
+        tablename = rarity+'_price_history_'+str(version)
+        print('{0} scraping {1} {2} cards from {3}'.format(worker, len(cards), rarity, setname))
+        try:
+            card_dict, failed = scrape_set_price_history(setname, cards, **scrape_kwargs)
+            done = [cardname for cardname in cards if cardname.split('/')[0] in card_dict]
+            if card_dict:
+                with mystic_connection() as connection:
+                    with connection.begin():
+                        create_price_history_table(connection, tablename)
+                        rows = set_price_rows(connection, tablename, setname, card_dict, incremental)
+                        copy_rows(connection, tablename, rows)
+            store.finish(rarity, setname, done, [cardname for cardname in cards if cardname not in done])
+        except Exception as error:
+            print('{0} failed to record {1}: {2!r}'.format(worker, setname, error))
+            store.finish(rarity, setname, [], cards, repr(error))
+
+def scrape_worker_process(state_path, version, incremental, scrape_kwargs):
+    ''' scrape_worker for a forked process: drops the database pool inherited from the parent before starting '''
+    dispose_engine(close=False)
+    scrape_worker(state_path, version, incremental, scrape_kwargs)
+
+def run_scrape_job(version, cards_df=None, rarities=['mythic', 'rare', 'uncommon', 'common'],
+                   state_path='data/scrape_state.db', fails_path='data/{}_fails.p', n_workers=1, retry_failures=True,
+                   refresh_before=None, incremental=False, **scrape_kwargs):
+    '''
+    Resumable version of record_prices_by_rarity_version: scrapes and records the price histories of all cards,
+    keeping per card progress in a SQLite state store so a rerun picks up where the last one stopped
+    Input:
+        version: price history table version, eg '2' for <rarity>_price_history_2
+        cards_df: cards to scrape (name, set_name, rarity), default all vintage cards
+        state_path: SQLite state store, reused across runs
+        fails_path: where to pickle each rarity's fail_dict, formatted with the rarity
+        n_workers: number of worker processes sharing the queue
+        retry_failures: whether to retry cards that failed in earlier runs
+        refresh_before: rescrape cards done before this time (unix seconds), eg for a daily refresh
+        incremental: only record points newer than those already recorded for each card
+        scrape_kwargs: passed on to scrape_set_price_history (concurrency, rate, retries...), the rate is split
+            evenly between the workers
+    Output:
+        dataframe of card counts in each status, by rarity
+    '''
+    if cards_df is None:
+        cards_df = pd.read_csv('data/all_vintage_cards.csv')
+    store = ScrapeJobStore(state_path)
+    store.add_cards(cards_df, rarities)
+    store.reset_running()
+    if retry_failures:
+        store.retry_failed()
+    if refresh_before is not None:
+        store.refresh(refresh_before)
+
+    if n_workers == 1:
+        scrape_worker(state_path, version, incremental, scrape_kwargs)
+    else:
+        # worker processes can't share a limiter, so each paces its own share of the rate
+        rate = scrape_kwargs.get('rate', MTGPRICE_RATE)
+        rate = rate.rate if isinstance(rate, TokenBucket) else rate
+        worker_kwargs = dict(scrape_kwargs, rate=rate/n_workers if rate else None)
+        workers = [multiprocessing.Process(target=scrape_worker_process,
+                                           args=(state_path, version, incremental, worker_kwargs))
+                   for _ in range(n_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    for rarity in rarities:
+        with open(fails_path.format(rarity), 'wb') as output_file:
+            pickle.dump(store.fail_dict(rarity), output_file)
+    return store.progress()
@@ -0,0 +1,170 @@
+import os, io, weakref
+from contextlib import contextmanager
+# connect to postgresql database
+from sqlalchemy import create_engine, text
+
+# Set to any sqlalchemy url (eg sqlite:///data/mystic.db, postgresql://localhost/mystic) to use a local stand-in
+MYSTIC_DB_ENV = 'MYSTIC_DB_URL'
+# Connection pool sizing, overridden by the MYSTIC_DB_POOL_SIZE and MYSTIC_DB_MAX_OVERFLOW environment variables,
+# eg to stay under the RDS connection limit when running several scrape workers
+POOL_SIZE_ENV = 'MYSTIC_DB_POOL_SIZE'
+MAX_OVERFLOW_ENV = 'MYSTIC_DB_MAX_OVERFLOW'
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+
+PRICE_HISTORY_COLUMNS = ['cardname', 'setname', 'timestamp', 'price']
+
+_engine = None
+# names of the statements prepared on each pooled DBAPI connection, see prepare_statement
+_prepared = weakref.WeakKeyDictionary()
+
+def mystic_url():
+    '''
+    Database url of mystic-speculation, from the MYSTIC_DB_URL environment variable if set,
+    otherwise the RDS instance with username and pw from scrape/login.txt
+    '''
+    url = os.environ.get(MYSTIC_DB_ENV)
+    if url:
+        return url
+
+    # Define database info
+    hostname = 'mystic-speculation.cwxojtlggspu.us-east-1.rds.amazonaws.com'
+    port = '5432'
+    dbname = 'mystic_speculation'
+
+    # load username and pw information for database
+    with open('scrape/login.txt', 'r') as login_info:
+        username = login_info.readline().strip()
+        password = login_info.readline().strip()
+
+    return 'postgresql://{0}:{1}@{2}:{3}/{4}'.format(username, password, hostname, port, dbname)
+
+def get_engine(pool_size=None, max_overflow=None):
+    '''
+    Returns the shared sqlalchemy engine to mystic-speculation, creating it on first use.
+    The engine keeps a pool of open connections, pinging them before reuse so dropped RDS
+    connections are replaced instead of failing the query.
+    Input:
+        pool_size: connections kept open, default MYSTIC_DB_POOL_SIZE if set, otherwise POOL_SIZE
+        max_overflow: connections opened beyond pool_size under load, default MYSTIC_DB_MAX_OVERFLOW if set,
+            otherwise MAX_OVERFLOW
+        Both only apply when the engine is created, call dispose_engine first to resize it
+    '''
+    global _engine
+    if _engine is None:
+        url = mystic_url()
+        if url.startswith('sqlite'):
+            # sqlite pools are per-thread/per-file and take no sizing
+            _engine = create_engine(url)
+        else:
+            if pool_size is None:
+                pool_size = int(os.environ.get(POOL_SIZE_ENV, POOL_SIZE))
+            if max_overflow is None:
+                max_overflow = int(os.environ.get(MAX_OVERFLOW_ENV, MAX_OVERFLOW))
+            _engine = create_engine(url,
+                                    pool_size=pool_size,
+                                    max_overflow=max_overflow,
+                                    pool_pre_ping=True)
+    return _engine
+
+def dispose_engine(close=True):
+    '''
+    Closes all pooled connections and forgets the engine, so the next connection re-reads the url and pool sizing.
+    In a forked child, pass close=False: the pooled connections belong to the parent and are dropped without
+    being closed, so the parent's sockets are left alone and the child opens its own.
+    '''
+    global _engine
+    if _engine is not None:
+        _engine.dispose(close=close)
+        _engine = None
+
+def connect_mystic():
+    '''
+    Connects to mystic-speculation database, returns connection object
+    Output:
+        SqlAlchemy connection object to mystic speculation database, checked out of the shared pool;
+        closing it returns it to the pool
+    '''
+    return get_engine().connect()
+
+@contextmanager
+def mystic_connection():
+    '''
+    Context manager handing out a pooled connection to mystic-speculation, returned to the pool on exit
+        with mystic_connection() as connection:
+            df = pd.read_sql(query, connection)
+    '''
+    connection = connect_mystic()
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def prepare_statement(connection, name, statement, types):
+    '''
+    PREPAREs statement (with $1, $2... placeholders of the given postgres types) as name on the DBAPI connection
+    under connection, unless it already was. Prepared statements live as long as the DBAPI connection, across
+    checkouts from the pool, so every later EXECUTE name(...) on it reuses the statement's cached plan.
+    psycopg2 fills in bound parameters on the client, so plain text() queries are planned afresh every time.
+    '''
+    names = _prepared.setdefault(connection.connection.connection, set())
+    if name not in names:
+        connection.exec_driver_sql("PREPARE {0} ({1}) AS {2}".format(name, ', '.join(types), statement))
+        names.add(name)
+
+def create_price_history_table(connection, tablename):
+    '''
+    Creates a price history table if it doesn't already exist, with timestamps as bigint ms since epoch
+    and a (setname, cardname, timestamp) index, serving per-card lookups, per-set scans and time ordered reads of a set
+    '''
+    connection.execute("CREATE TABLE IF NOT EXISTS {} (cardname text, setname text, timestamp bigint, price float)".format(tablename))
+    connection.execute("CREATE INDEX IF NOT EXISTS {0}_set_card_time_idx ON {0} (setname, cardname, timestamp)".format(tablename))
+
+def copy_rows(connection, tablename, rows_df):
+    '''
+    Bulk loads a dataframe into a table with columns of the same names, streaming it through COPY FROM STDIN
+    on postgres and falling back to a single executemany insert on other databases (eg a sqlite stand-in).
+    Runs in the caller's transaction, so wrap in connection.begin() to commit.
+    '''
+    if rows_df.shape[0] == 0:
+        return
+    columns = ', '.join(rows_df.columns)
+    if connection.dialect.driver == 'psycopg2':
+        buffer = io.StringIO()
+        rows_df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert("COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)".format(tablename, columns), buffer)
+        cursor.close()
+    else:
+        values = ', '.join(':'+column for column in rows_df.columns)
+        insert = text("INSERT INTO {0} ({1}) values ({2})".format(tablename, columns, values))
+        connection.execute(insert, rows_df.to_dict('records'))
+
+def migrate_price_history_table(connection, tablename):
+    '''
+    Migrates a price history table written with text timestamps to bigint timestamps, and swaps the earlier
+    (cardname, setname, timestamp) index for the (setname, cardname, timestamp) one. Steps already done are skipped.
+    Input:
+        connection: sqlalchemy connection to mystic-speculation
+        tablename: name of the price history table, eg mythic_price_history_2
+    '''
+    column_type = connection.execute(text("select data_type from information_schema.columns "
+                                          "where table_name = :tablename and column_name = 'timestamp'"),
+                                     {'tablename': tablename}).scalar()
+    if column_type is None:
+        raise ValueError('no price history table named {}'.format(tablename))
+    if column_type != 'bigint':
+        print('migrating {0} timestamps from {1} to bigint'.format(tablename, column_type))
+        connection.execute("ALTER TABLE {} ALTER COLUMN timestamp TYPE bigint "
+                           "USING cast(cast(timestamp as float) as bigint)".format(tablename))
+    connection.execute("DROP INDEX IF EXISTS {}_card_time_idx".format(tablename))
+    create_price_history_table(connection, tablename)
+    connection.execute("ANALYZE {}".format(tablename))
+
+def migrate_price_history_tables(rarities=['mythic', 'rare', 'uncommon', 'common'], version=2):
+    ''' Migrates the price history table of each rarity, each in its own transaction '''
+    for rarity in rarities:
+        tablename = rarity+'_price_history_'+str(version)
+        with get_engine().begin() as connection:
+            migrate_price_history_table(connection, tablename)
@@ -1,15 +1,24 @@
 import numpy as np
 import pandas as pd
-import json, requests, pickle, time
+import json, pickle, gzip, re
 from bs4 import BeautifulSoup
 from collections import defaultdict
 # trying slimit parser
 from slimit import ast
 from slimit.parser import Parser
 from slimit.visitors import nodevisitor
+from scrape.fetch import fetch_pages, http_get, rate_limiter
+from sqlalchemy import text
 # connect to postgresql database
-from sqlalchemy import create_engine
-import psycopg2
+from scrape.mystic_db import connect_mystic, mystic_connection, create_price_history_table, copy_rows, PRICE_HISTORY_COLUMNS
+
+SCRYFALL_URL = 'https://api.scryfall.com/'
+MTGPRICE_URL = 'https://www.mtgprice.com/sets/'
+# requests per second to MTGPrice.com, across a whole scrape
+MTGPRICE_RATE = 10
+# "data": [[timestamp, price], ...] in MTGPrice.com price results, and the pairs within it
+PRICE_DATA_PATTERN = re.compile(r'"data"\s*:\s*\[((?:\s*\[[^\[\]]*\]\s*,?)*)\s*\]')
+PRICE_PAIR_PATTERN = re.compile(r'\[\s*([-+.\deE]+)\s*,\s*([-+.\deE]+)\s*\]')
 
 def MVP_features(cards_df):
     '''
@@ -61,17 +70,12 @@ def MVP_features(cards_df):
     ]
     return cards_df[MVP_features]
 
-def load_card_page(page):
+def legal_cards_frame(cards):
     '''
-    Gets a page of scryfall cards from their API and formats it into a dataframe, removing unwanted cards.
-    Input:
-        page is a positive integer representing the page number
+    Formats a list of scryfall card objects into a dataframe, removing unwanted cards.
     Output:
-        legal_cards, a pandas dataframe of all cards on the page 
+        legal_cards, a pandas dataframe of the cards, indexed by scryfall id
     '''
-    link = 'https://api.scryfall.com/cards?page='+str(page)
-    response = requests.get(link)
-    cards = response.json()['data']
     cards_df = pd.DataFrame(cards)
     
     # Filters not legal in vintage (tokens, joke cards, conspiracies, etc.), only english cards
@@ -79,41 +83,148 @@ def load_card_page(page):
     legal_cards.set_index('id', inplace=True)
     return legal_cards
 
-def load_card_features(n=1320):
+def load_card_page(page, base_url=SCRYFALL_URL, cache=None):
+    '''
+    Gets a page of scryfall cards from their API and formats it into a dataframe, removing unwanted cards.
+    Input:
+        page is a positive integer representing the page number
+        cache: optional fetch.HTTPCache to go through
+    Output:
+        legal_cards, a pandas dataframe of all cards on the page 
+    '''
+    link = base_url+'cards?page='+str(page)
+    response = http_get(link, cache)
+    return legal_cards_frame(json.loads(response)['data'])
+
+def load_cards(n=1320, base_url=SCRYFALL_URL, concurrency=8, rate=10, cache=None):
+    '''
+    Loads the first n pages of cards from scryfall API concurrently, at most rate requests per second
+    (scryfall asks for no more than 10), concatenating the pages once at the end.
+    Pages go through cache (a fetch.HTTPCache) if given.
+    Output:
+        dataframe of the legal cards of all pages, in page order
+    '''
+    links = [base_url+'cards?page='+str(page+1) for page in range(n)]
+    def progress(i, result):
+        if not isinstance(result, Exception):
+            print('just scraped this page: {}'.format(i+1))
+    pages = fetch_pages(links, concurrency=concurrency, rate=rate, on_result=progress, cache=cache)
+
+    frames = []
+    for i, page in enumerate(pages):
+        try:
+            if isinstance(page, Exception):
+                raise page
+            frames.append(legal_cards_frame(json.loads(page)['data']))
+        except Exception as error:
+            print('FAILED to load page {0}: {1!r}'.format(i+1, error))
+    return pd.concat(frames, sort=True)
+
+def iter_bulk_cards(path, chunk_bytes=2**20):
+    '''
+    Streams card objects out of a scryfall bulk data file (one big json array, optionally gzipped),
+    decoding one card at a time instead of loading the whole file
+    '''
+    decoder = json.JSONDecoder()
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as bulk_file:
+        buffer = ''
+        position = 0
+        done = False
+        while True:
+            # skip array punctuation between cards
+            while position < len(buffer) and buffer[position] in '[], \t\r\n':
+                position += 1
+            try:
+                card, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if done:
+                    if buffer[position:].strip():
+                        raise
+                    return
+                chunk = bulk_file.read(chunk_bytes)
+                done = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield card
+
+def load_bulk_cards(path, chunksize=10000):
+    '''
+    Loads cards from a scryfall bulk data file (eg all-cards or default-cards, from https://scryfall.com/docs/api/bulk-data),
+    as an alternative to paging through the API
+    Output:
+        dataframe of the legal cards in the file
+    '''
+    frames = []
+    chunk = []
+    for card in iter_bulk_cards(path):
+        chunk.append(card)
+        if len(chunk) == chunksize:
+            frames.append(legal_cards_frame(chunk))
+            chunk = []
+    if chunk:
+        frames.append(legal_cards_frame(chunk))
+    return pd.concat(frames, sort=True)
+
+def load_card_features(n=1320, bulk_file=None, outfile='data/all_vintage_cards.csv', **load_kwargs):
     '''
     Loads cards from scryfall API, up to n pages (scryfall cards are paginated), and selecting
     only the desired card features.
     Input:
         n is number of scryfall pages to search - default is all of them.
+        bulk_file: optional path of a scryfall bulk data file to read instead of the API
+        load_kwargs: passed on to load_cards (base_url, concurrency, rate)
     Output:
         None; writes the extracted cards to csv file. 
     '''
     # read n pages (1320 total as of 11/8/2018)
-    cards = pd.DataFrame()
-    for n in range(n):
-        page = load_card_page(n+1)
-        cards = pd.concat([cards, page], sort=True)
-        print('just scraped this page: {}'.format(n+1))
-        print('this many cards so far: {}'.format(cards.shape[0]))
-        # sleep for 10 ms per scryfall API guidelines
-        time.sleep(0.01)
+    if bulk_file is not None:
+        cards = load_bulk_cards(bulk_file)
+    else:
+        cards = load_cards(n, **load_kwargs)
     print('FINAL CARD TALLY: {}'.format(cards.shape[0]))
     print(' ~~~ cleaning everything now ~~~ ')
     MVP_data = MVP_features(cards)
     print(' ~~~ writing to csv ~~~ ')
-    MVP_data.to_csv(path_or_buf='data/all_vintage_cards.csv')
+    MVP_data.to_csv(path_or_buf=outfile)
+
+def card_price_link(setname, cardname, base_url=MTGPRICE_URL):
+    ''' MTGPrice.com page of a card '''
+    return base_url + '_'.join(setname.split()) + '/' + '_'.join(cardname.split())
 
-def card_price_history(setname, cardname):
+def fast_price_history(content):
     '''
-    Scrapes price history of card from MTGPrice.com, using javascript parser
-    Input:
-        Setname and cardname are strings, generally taken from Scryfall API.
+    Extracts the price history from the content of an MTGPrice.com card page with targeted string scans:
+    finds the script holding 'var results = [', then its first "data" array of [timestamp, price] pairs.
+    Raises ValueError if the page doesn't look as expected.
+    Output:
+        A numpy array of price history, each 'row' in the form [timestamp, price], as strings like the javascript parser
+    '''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    results = content.find('var results = [')
+    if results < 0:
+        raise ValueError('no price results on page')
+    script = content.rfind('<script', 0, results)
+    match = PRICE_DATA_PATTERN.search(content, script if script >= 0 else 0)
+    if match is None:
+        raise ValueError('no price data array on page')
+    data = match.group(1)
+    history = PRICE_PAIR_PATTERN.findall(data)
+    # every bracket in the array should belong to a pair we understood
+    if len(history) != data.count('['):
+        raise ValueError('unexpected price data format')
+    return np.array(history)
+
+def slimit_price_history(content):
+    '''
+    Extracts the price history from the content of an MTGPrice.com card page, using javascript parser
     Output:
         A numpy array of price history, each 'row' in the form [timestamp, price]
     '''
     # Turn card data into soup
-    link = 'https://www.mtgprice.com/sets/' + '_'.join(setname.split()) + '/' + '_'.join(cardname.split())
-    soup = BeautifulSoup(requests.get(link).content, 'html.parser')
+    soup = BeautifulSoup(content, 'html.parser')
 
     # GET RESULTS
     text_to_find = 'var results = ['
@@ -129,35 +240,106 @@ def card_price_history(setname, cardname):
                     break
     return np.array(history)
 
-def sets_price_history(sets, all_cards_df):
+def parse_price_history(content):
+    '''
+    Extracts the price history from the content of an MTGPrice.com card page, with the fast string scan,
+    falling back to the javascript parser for pages it doesn't understand
+    Output:
+        A numpy array of price history, each 'row' in the form [timestamp, price]
+    '''
+    try:
+        return fast_price_history(content)
+    except ValueError:
+        return slimit_price_history(content)
+
+def card_price_history(setname, cardname, cache=None):
+    '''
+    Scrapes price history of card from MTGPrice.com, using javascript parser
+    Input:
+        Setname and cardname are strings, generally taken from Scryfall API.
+        cache: optional fetch.HTTPCache to go through
+    Output:
+        A numpy array of price history, each 'row' in the form [timestamp, price]
+    '''
+    return parse_price_history(http_get(card_price_link(setname, cardname), cache))
+
+def scrape_set_price_history(setname, cards, base_url=MTGPRICE_URL, concurrency=8, rate=MTGPRICE_RATE, retries=3,
+                             backoff=1.0, cache=None):
+    '''
+    Scrapes price histories of the cards of a set from MTGPrice.com concurrently, see fetch.fetch_all for the
+    concurrency, rate limit (requests/s, or a TokenBucket shared with other sets), retry and cache options.
+    Cards are judged in set order as when scraping one at a time: if the first card fails and a later one does too,
+    the whole set is treated as failed and no later cards are kept. The first two cards are scraped before the rest,
+    so a set MTGPrice doesn't have costs two requests rather than one per card.
+    Input:
+        setname: name of the set
+        cards: card names in the set
+    Output:
+        card_dict, dictionary of (card, price history) kv pairs of the scraped cards, in set order
+        failed, set of cards that failed to scrape
+    '''
+    cardnames = [cardname.split('/')[0] if '/' in cardname else cardname for cardname in cards]
+    links = [card_price_link(setname, cardname, base_url) for cardname in cardnames]
+    # one limiter for the probe and the fan-out
+    rate = rate_limiter(rate)
+
+    def progress(i, result):
+        status = 'FAILED' if isinstance(result, Exception) else 'scraped'
+        print('\t{0} card {1} from {2}: {3}'.format(status, i, setname, cardnames[i]))
+
+    def scrape(start, stop):
+        ''' Price histories of cards start to stop, or the exception each failed with '''
+        pages = fetch_pages(links[start:stop], concurrency=concurrency, rate=rate, retries=retries, backoff=backoff,
+                            on_result=lambda i, result: progress(start+i, result), cache=cache)
+        histories = []
+        for page in pages:
+            try:
+                if isinstance(page, Exception):
+                    raise page
+                histories.append(parse_price_history(page))
+            except Exception as error:
+                histories.append(error)
+        return histories
+
+    # two failures up front fail the set, so only fan out to the rest of it once one of the first two worked
+    histories = scrape(0, 2)
+    if not all(isinstance(history, Exception) for history in histories):
+        histories += scrape(2, len(links))
+
+    card_dict = {}
+    failed = set()
+    first_try = True
+    for i, (cardname, history) in enumerate(zip(cardnames, histories)):
+        if not isinstance(history, Exception):
+            card_dict[cardname] = history
+            continue
+        if i == 0:
+            first_try = False
+        elif not first_try:
+            print('\t\tSET SCRAPE FAIL!\n\t\tfailed set: {}'.format(setname))
+            failed.update(set(cards))
+            break
+        print('\t\tCARD SCRAPE FAIL!\n\t\tfailed at #{0} card: {1}'.format(i+1, cardname))
+        failed.add(cardname)
+    return card_dict, failed
+
+def sets_price_history(sets, all_cards_df, **scrape_kwargs):
     '''
     Scrapes price data from MTGPrice.com for all cards in a given list of sets.
     Input:
-        sets is a list of sets to scrape, all_cards_df is a pandas dataframe of cards
+        sets is a list of sets to scrape, all_cards_df is a pandas dataframe of cards,
+        scrape_kwargs are passed on to scrape_set_price_history
     Output:
         set_dict is a dictionary with keys being magic set names from 'sets', and values
         being dictionaries of (cards, price history) kv pairs for each card in the set.
     '''
     set_dict = {}
+    # one limiter for all sets, so rate holds across the whole scrape
+    scrape_kwargs['rate'] = rate_limiter(scrape_kwargs.get('rate', MTGPRICE_RATE))
     for setname in sets:
         print('Scraping set from MTGPrice.com: {}'.format(setname))
         cards = all_cards_df[all_cards_df['set_name'] == setname]['name'].values
-        card_dict = {}
-        for i, cardname in enumerate(cards):
-            if '/' in cardname:
-                cardname = cardname.split('/')[0]
-            print('Scraping card from MTGPrice.com: {}'.format(cardname))
-            try:
-                history = card_price_history(setname, cardname)
-                card_dict[cardname] = history
-                print('successfully scraped {0} from {1}'.format(cardname, setname))
-                # time.sleep()
-            except:
-                if i == 1:
-                    print('SET SCRAPE FAIL!\nfailed set: {}'.format(setname))
-                    break
-                else:
-                    print('CARD SCRAPE FAIL!\nfailed at #{0} card: {1}'.format(i, cardname))                
+        card_dict, failed = scrape_set_price_history(setname, cards, **scrape_kwargs)
         set_dict[setname] = card_dict
     return set_dict
 
@@ -168,29 +350,121 @@ def pickle_all_sets():
     with open("data/all_vintage_price_scrape.p", 'wb') as output_file:
         pickle.dump(set_dict, output_file)
 
-def record_price_history(connection, tablename, setname, cardname, history):
+def dedup_price_history(history, since=None, last_prices=(0.0, 0.0)):
+    '''
+    Drops repeat prices and minor variations from a card price history: prices are rounded to 10 cents,
+    and a price is kept only if it's positive and differs from both of the last two kept prices
+    Input:
+        history: price data, np array with rows of [timestamp (ms), price]
+        since: optional timestamp (ms), only points after it are kept, eg the last one already recorded
+        last_prices: the last two kept prices, most recent first, to carry on from a recorded history
+    Output:
+        timestamps (int64 ms) and prices (float64) arrays of the kept price points
+    '''
+    history = np.asarray(history).reshape(-1, 2)
+    timestamps = history[:, 0].astype(float).astype(np.int64)
+    prices = np.round(history[:, 1].astype(float), 1)
+    if since is not None:
+        keep = timestamps > since
+        timestamps, prices = timestamps[keep], prices[keep]
+
+    # Positive prices only, then collapse runs of the same price, which the last-price check always drops
+    keep = prices > 0
+    timestamps, prices = timestamps[keep], prices[keep]
+    keep = np.ones(prices.shape[0], dtype=bool)
+    keep[1:] = prices[1:] != prices[:-1]
+    timestamps, prices = timestamps[keep], prices[keep]
+
+    # Flip-flops between the last two prices need the kept history, so walk what's left
+    keep = np.zeros(prices.shape[0], dtype=bool)
+    last_prices = list(last_prices)
+    for i, price in enumerate(prices):
+        if (price != last_prices[0]) and (price != last_prices[1]):
+            keep[i] = True
+            last_prices = [price, last_prices[0]]
+    return timestamps[keep], prices[keep]
+
+def price_history_rows(setname, cardname, history, since=None, last_prices=(0.0, 0.0)):
+    ''' Deduped card price history as a dataframe of price history table rows, see dedup_price_history '''
+    timestamps, prices = dedup_price_history(history, since, last_prices)
+    return pd.DataFrame({'cardname': cardname,
+                         'setname': setname,
+                         'timestamp': timestamps,
+                         'price': prices}, columns=PRICE_HISTORY_COLUMNS)
+
+def recorded_price_marks(connection, tablename, setname, cardnames):
+    '''
+    Finds where each of the given cards of a set left off, in one query; cards with nothing recorded are left out.
+    On postgres each card's last two rows are read straight off the end of its stretch of the
+    (setname, cardname, timestamp) index, so the cost doesn't grow with how much history is recorded.
+    Output:
+        Dictionary with cardname keys, and (last recorded timestamp, last two recorded prices) values
+    '''
+    params = {'setname': setname}
+    for i, cardname in enumerate(cardnames):
+        params['cardname_{}'.format(i)] = cardname
+    names = [':cardname_{}'.format(i) for i in range(len(params)-1)]
+    if not names:
+        return {}
+    if connection.dialect.name == 'postgresql':
+        cards = ", ".join("({})".format(name) for name in names)
+        query = text("select cards.cardname, recent.timestamp, recent.price "
+                     "from (values {1}) as cards (cardname) "
+                     "cross join lateral (select timestamp, price from {0} ph "
+                     "                    where ph.setname = :setname and ph.cardname = cards.cardname "
+                     "                    order by timestamp desc limit 2) recent "
+                     "order by cards.cardname, recent.timestamp desc ".format(tablename, cards))
+    else:
+        # no lateral joins on stand-ins like sqlite
+        query = text("select cardname, timestamp, price "
+                     "from (select cardname, timestamp, price, "
+                     "             row_number() over (partition by cardname order by timestamp desc) as recency "
+                     "      from {0} "
+                     "      where setname = :setname and cardname in ({1})) recent "
+                     "where recency <= 2 "
+                     "order by cardname, recency ".format(tablename, ", ".join(names)))
+    marks = {}
+    for cardname, timestamp, price in connection.execute(query, params):
+        if cardname in marks:
+            marks[cardname] = (marks[cardname][0], (marks[cardname][1][0], price))
+        else:
+            marks[cardname] = (int(timestamp), (price, 0.0))
+    return marks
+
+def set_price_rows(connection, tablename, setname, card_dict, incremental=False):
+    '''
+    Price history table rows of a set's scraped cards
+    Input:
+        card_dict: dictionary of (card, price history) kv pairs
+        incremental: only keep points newer than those already recorded for each card, deduped against its recorded prices
+    Output:
+        dataframe of rows to record
+    '''
+    marks = recorded_price_marks(connection, tablename, setname, list(card_dict)) if incremental else {}
+    set_rows = []
+    for cardname, history in card_dict.items():
+        since, last_prices = marks.get(cardname, (None, (0.0, 0.0)))
+        set_rows.append(price_history_rows(setname, cardname, history, since, last_prices))
+    return pd.concat(set_rows, ignore_index=True)
+
+def record_price_history(connection, tablename, setname, cardname, history, incremental=False):
     '''
     Takes card price history and loads it into given database and table
     Input:
         connection: database connection object
         tablename: name of the target SQL table in the database
         setname, cardname: the data to be loaded into the corresponding table columns 
-        history: price data, np array with rows of [timestamp, price]
+        history: price data, np array with rows of [timestamp (ms), price]
+        incremental: only record points newer than those already recorded for the card
     '''
-    # create table if it doesn't already exist
-    connection.execute("CREATE TABLE IF NOT EXISTS {} (cardname text, setname text, timestamp text, price float)".format(tablename))
-    
-    # populate card history, ignoring repeat prices and minor variations
-    last_prices = [0.0,0.0]
-    insert = "INSERT INTO {} (cardname, setname, timestamp, price) values ".format(tablename)
-    for (timestamp, price) in history:
-        price = round(float(price), 1)
-        if (price > 0) and (price != last_prices[0]) and (price != last_prices[1]):
-            values="('{0}', '{1}', '{2}', {3})".format(cardname.replace("'","''"), setname.replace("'","''"), timestamp, price)
-            connection.execute(insert + values)
-            last_prices = [price, last_prices[0]]
+    with connection.begin():
+        # create table if it doesn't already exist
+        create_price_history_table(connection, tablename)
+        # populate card history, ignoring repeat prices and minor variations
+        rows = set_price_rows(connection, tablename, setname, {cardname: history}, incremental)
+        copy_rows(connection, tablename, rows)
 
-def record_sets_price_history(connection, tablename, sets, cards_df):
+def record_sets_price_history(connection, tablename, sets, cards_df, incremental=False, **scrape_kwargs):
     '''
     Scrapes price data from MTGPrice.com for all cards in a given list of sets.
     Input:
@@ -198,71 +472,43 @@ def record_sets_price_history(connection, tablename, sets, cards_df):
         tablename: name of the target SQL table in the database
         sets: list of sets to search through and add to database, starting from most recent
         cards_df: dataframe of cards, including columns for name and set_name
+        incremental: only record points newer than those already recorded for each card
+        scrape_kwargs: passed on to scrape_set_price_history (concurrency, rate, retries...)
     Output:
         Dictionary of failed cards and their sets
     '''
     fail_dict = defaultdict(set)
+    # create table if it doesn't already exist
+    with connection.begin():
+        create_price_history_table(connection, tablename)
 
+    # one limiter for all sets, so rate holds across the whole scrape
+    scrape_kwargs['rate'] = rate_limiter(scrape_kwargs.get('rate', MTGPRICE_RATE))
     for setname in sets:
         print('Scraping set from MTGPrice.com: {}'.format(setname))
         cards = cards_df[cards_df['set_name'] == setname]['name'].values
         total = cards.shape[0]
         count = 0
-        first_try = True
-        for i, cardname in enumerate(cards):
-            if '/' in cardname:
-                cardname = cardname.split('/')[0]
-            print('\tScraping card {0} from {1}: {2}'.format(i, setname, cardname))
-            # Attempt to scrape card
+        card_dict, failed = scrape_set_price_history(setname, cards, **scrape_kwargs)
+        fail_dict[setname].update(failed)
+
+        # Attempt to record the set's histories into database, in one transaction
+        if card_dict:
             try:
-                history = card_price_history(setname, cardname)
-                print('\tSuccessfully scraped {0} from {1}'.format(cardname, setname))      
-                try:
-                    record_price_history(connection, tablename, setname, cardname, history)
-                    print('\tSuccessfully recorded {0} ({1}) into database'.format(cardname, setname))
-                    count += 1
-                except:
-                    print('\tFailed to record {0} ({1}) into database'.format(cardname, setname))
-                    fail_dict[setname].add(cardname)
+                with connection.begin():
+                    rows = set_price_rows(connection, tablename, setname, card_dict, incremental)
+                    copy_rows(connection, tablename, rows)
+                count = len(card_dict)
+                print('\tSuccessfully recorded {0} cards from {1} into database'.format(count, setname))
             except:
-                if i == 0:
-                    first_try = False
-                elif not first_try:
-                    print('\t\tSET SCRAPE FAIL!\n\t\tfailed set: {}'.format(setname))
-                    fail_dict[setname].update(set(cards))
-                    break
-                print('\t\tCARD SCRAPE FAIL!\n\t\tfailed at #{0} card: {1}'.format(i+1, cardname))
-                fail_dict[setname].add(cardname)
-            # Attempt to record history into database
-
+                print('\tFailed to record {0} into database'.format(setname))
+                fail_dict[setname].update(card_dict)
                            
         print('Finished attempt at scraping set: {}'.format(setname))
         print('Total cards in set: {0}\nTotal cards recorded: {1}'.format(total, count))
     
     return fail_dict
 
-def connect_mystic():
-    '''
-    Connects to mystic-speculation database, returns connection object
-    Output:
-        SqlAlchemy PostgreSQL connection object to mystic speculation database
-    '''
-    # Define database info
-    hostname = 'mystic-speculation.cwxojtlggspu.us-east-1.rds.amazonaws.com'
-    port = '5432'
-    dbname = 'mystic_speculation'
-
-    # load username and pw information for database
-    with open('scrape/login.txt', 'r') as login_info:
-        username = login_info.readline().strip()
-        password = login_info.readline().strip()
-
-    # connect to database with sqlalchemy engine
-    db_string = 'postgres://{0}:{1}@{2}:{3}/{4}'.format(username, password, hostname, port, dbname)
-    engine = create_engine(db_string)
-    connection = engine.connect()
-    return connection
-
 def record_prices_by_rarity(connection, rarities, version, sets, cards_df):
     '''
     Rarities is a list of strings representing the card rarity of which to create the table
@@ -282,15 +528,15 @@ def record_prices_by_rarity(connection, rarities, version, sets, cards_df):
 
 def clear_rarity_tables(version=''):
     rarities = ['mythic', 'rare', 'uncommon', 'common']
-    connection = connect_mystic()
-    for rarity in rarities:
-        tablename = rarity+'_price_history'+version
-        del_string = "delete from {} *".format(tablename)
-        connection.execute(del_string)
-        results = connection.execute("select * from {}".format(tablename))
-        print('nothing here if {} deleted successfully:'.format(tablename))
-        for r in results:
-            print(r)
+    with mystic_connection() as connection:
+        for rarity in rarities:
+            tablename = rarity+'_price_history'+version
+            del_string = "delete from {} *".format(tablename)
+            connection.execute(del_string)
+            results = connection.execute("select * from {}".format(tablename))
+            print('nothing here if {} deleted successfully:'.format(tablename))
+            for r in results:
+                print(r)
 
 def record_prices_by_rarity_version(version):
     # Connect to database, load card source
@@ -15,8 +15,8 @@ from query import *
 connection = connect_mystic()
 
 # Plots Mythic history
-def plot_price_history(rarity, version=2):
-    history_df = get_price_history(rarity, version)
+def plot_price_history(rarity, version=2, dataset=None):
+    history_df = get_price_history(rarity, version, dataset)
     def time_bomb(row):
         date = pd.Timestamp.utcfromtimestamp(int(row['timestamp'])/1000)
         row['year'] = date.year
@@ -1,3 +1,5 @@
+import time
+from contextlib import contextmanager
 from model.master_transmuter import *
 from model.models import *
 from scrape.scraper import *
@@ -31,22 +33,8 @@ def test_feature_engineering(cards_df):
     print(new_feats_df[new_feats])
 
 def query_rarity_dfs(rarity='mythic', version=2, rows=10):
-    tablename = rarity+'_price_history_'+str(version)
-    connection = connect_mystic()
-
-    query = ("select ph.cardname, ph.setname, ph.timestamp, ph.price "
-            "from {0} ph, "
-            "     (select ph2.cardname, ph2.setname, max(timestamp) as lastdate "
-            "      from {0} ph2 "
-            "      group by ph2.cardname, ph2.setname) mr "
-            "where ph.timestamp = mr.lastdate "
-            "and ph.cardname = mr.cardname "
-            "and ph.setname = mr.setname ").format(tablename)
-
-    # Do the thing
-    recent_df = pd.read_sql(query, connection)
-    connection.close()
-    return recent_df.sample(rows)
+    # sampled on the server, so only rows cards come back
+    return get_recent_prices(rarity, version, sample=rows)
 
 def chandra_price_check():
     cardname = 'Chandra, Torch of Defiance'
@@ -56,6 +44,370 @@ def chandra_price_check():
     df = get_twavg_card(cardname, setname, seasons, tablename)
     print(df)
 
+def test_local_twavg(rarity='mythic', version=2):
+    """ Checks the in-memory seasonal time weighted averages against the SQL ones, for the database connect_mystic points at """
+    seasons = np.array(pd.read_csv("data/season_dates.csv"))
+    tablename = rarity+"_price_history_"+str(version)
+    sql_df = w_avg_price_by_season(seasons, tablename).sort_values(['cardname','setname']).reset_index(drop=True)
+    local_df = local_w_avg_price_by_season(get_price_history(rarity, version), seasons)
+    local_df = local_df.sort_values(['cardname','setname']).reset_index(drop=True)
+
+    assert list(sql_df.columns) == list(local_df.columns), "season columns differ"
+    assert (sql_df[['cardname','setname']].values == local_df[['cardname','setname']].values).all(), "cards differ"
+    season_cols = get_seasons(sql_df)
+    assert np.allclose(sql_df[season_cols].astype(float), local_df[season_cols].astype(float), equal_nan=True), \
+        "seasonal averages differ"
+    print("Local time weighted averages match SQL for {} {} cards".format(sql_df.shape[0], rarity))
+
+def test_twavg_by_season():
+    """ Checks twavg_by_season on a small synthetic history against averages worked out by hand """
+    # the SQL's date_part('day', ...) reads ms timestamps as seconds, so a 'day' there is 86400 ms
+    day = 86400
+    starts = np.array([10, 20, 40])*day
+    ends = np.array([20, 30, 50])*day
+    history = [
+        # card 0: a point before the first season, and one on the bound between seasons 1 & 2
+        (0, 5, 2.0), (0, 15, 4.0), (0, 20, 6.0), (0, 25, 8.0),
+        # card 1: nothing before season 3
+        (1, 45, 3.0),
+        # card 2: a single point on the start of season 1
+        (2, 10, 5.0),
+        # card 3: a single point on the end of season 3, leaving it no span to weight
+        (3, 50, 7.0),
+    ]
+    card_ids = np.array([card for card, _, _ in history])
+    timestamps = np.array([t for _, t, _ in history])*day
+    prices = np.array([price for _, _, price in history])
+
+    averages, exists = twavg_by_season(card_ids, timestamps, prices, starts, ends)
+    expected = np.array([
+        # s1: 2->4 over 5 days, then 4 (the end bookend, before the point on it) for 5 days: (15 + 20)/10
+        # s2: bookend 4, point 6 on the start, 6->8 over 5 days, 8 to the end: (35 + 40)/10
+        # s3: empty, bookended by the last price 8
+        [3.5, 7.5, 8.0],
+        [np.nan, np.nan, 3.0],
+        [5.0, 5.0, 5.0],
+        [np.nan, np.nan, np.nan],
+    ])
+    assert np.allclose(averages, expected, equal_nan=True), averages
+    assert (exists == np.array([[True, True, True],
+                                [False, False, True],
+                                [True, True, True],
+                                [False, False, True]])).all(), exists
+    print('twavg_by_season matches hand worked averages')
+
+def test_dedup_price_history(n_cards=200, seed=0):
+    """ Checks the numpy price history dedup against the original row by row last-two-prices filter """
+    rng = np.random.RandomState(seed)
+    for _ in range(n_cards):
+        n = rng.randint(0, 300)
+        timestamps = np.sort(rng.randint(1300000000000, 1540000000000, size=n)).astype(str)
+        # few distinct prices, so repeats and flip-flops are common
+        prices = rng.choice([0, 0.98, 1.0, 1.04, 2.5, 2.46, 3.0], size=n).astype(str)
+        history = np.array([timestamps, prices]).T
+
+        expected = []
+        last_prices = [0.0,0.0]
+        for (timestamp, price) in history:
+            price = round(float(price), 1)
+            if (price > 0) and (price != last_prices[0]) and (price != last_prices[1]):
+                expected.append([int(timestamp), price])
+                last_prices = [price, last_prices[0]]
+
+        timestamps, prices = dedup_price_history(history)
+        assert [[t, p] for t, p in zip(timestamps.tolist(), prices.tolist())] == expected
+    print('dedup matches row by row filter on {} cards'.format(n_cards))
+
+STUB_PRICE_PAGE = ('<html><script type="text/javascript">var results = [{"name": "stub", '
+                   '"data": [[1500000000000, 1.5], [1500086400000, 2.0]]}];</script></html>').encode()
+
+def stub_mtgprice_server(handler_fn):
+    """
+    Starts a local stub MTGPrice server on a free port, answering each GET with handler_fn(request) -> (status, headers).
+    200s come with STUB_PRICE_PAGE as body. Returns (server, base_url of its set pages); shut the server down when done
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    import threading
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, headers = handler_fn(self)
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            if status == 200:
+                self.send_header('Content-Length', str(len(STUB_PRICE_PAGE)))
+            self.end_headers()
+            if status == 200:
+                self.wfile.write(STUB_PRICE_PAGE)
+        def log_message(self, *args):
+            pass
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/sets/'.format(server.server_port)
+
+@contextmanager
+def sqlite_mystic_db(path):
+    """ Points MYSTIC_DB_URL at a sqlite stand-in database at path, restoring the previous url and engine on the way out """
+    from scrape import mystic_db
+    import os
+    previous = os.environ.get('MYSTIC_DB_URL')
+    os.environ['MYSTIC_DB_URL'] = 'sqlite:///' + path
+    mystic_db.dispose_engine()
+    try:
+        yield
+    finally:
+        mystic_db.dispose_engine()
+        if previous is None:
+            del os.environ['MYSTIC_DB_URL']
+        else:
+            os.environ['MYSTIC_DB_URL'] = previous
+
+def test_async_scraper(n_cards=40, concurrency=8):
+    """
+    Scrapes a fake set from a local stub MTGPrice server, which fails every page once to exercise the retries,
+    then a missing set, which should cost only its first two cards
+    """
+    seen = set()
+    def stub(request):
+        if request.path not in seen or request.path.startswith('/sets/Missing_Set/'):
+            seen.add(request.path)
+            return 503, {}
+        # pretend to be a slow page
+        time.sleep(0.05)
+        return 200, {}
+    server, base_url = stub_mtgprice_server(stub)
+
+    cards = ['Stub Card {}'.format(i) for i in range(n_cards)]
+    start = time.time()
+    card_dict, failed = scrape_set_price_history('Stub Set', cards, base_url=base_url,
+                                                 concurrency=concurrency, rate=None, backoff=0.01)
+    print('scraped {0} stub cards in {1:.2f}s with concurrency {2}'.format(len(card_dict), time.time()-start, concurrency))
+    assert not failed
+    assert list(card_dict) == cards
+    assert all(history.shape == (2, 2) for history in card_dict.values())
+
+    # notebooks call in from a running event loop, where asyncio.run isn't allowed
+    import asyncio
+    async def from_running_loop():
+        return scrape_set_price_history('Stub Set', cards[:2], base_url=base_url, rate=None)
+    card_dict, failed = asyncio.run(from_running_loop())
+    assert not failed and list(card_dict) == cards[:2]
+
+    # a set whose first two cards fail is given up on without requesting the rest
+    card_dict, failed = scrape_set_price_history('Missing Set', cards, base_url=base_url,
+                                                 concurrency=concurrency, rate=None, backoff=0.01)
+    server.shutdown()
+    assert not card_dict and failed == set(cards)
+    assert len([path for path in seen if path.startswith('/sets/Missing_Set/')]) == 2
+
+def test_rate_limiter(n_sets=3, n_cards=10, rate=20):
+    """ Scrapes several stub sets with sets_price_history, checking the rate holds across sets rather than per fetch """
+    server, base_url = stub_mtgprice_server(lambda request: (200, {}))
+    cards_df = pd.DataFrame([{'name': 'Card {}'.format(i), 'set_name': 'Set {}'.format(s)}
+                             for s in range(n_sets) for i in range(n_cards)])
+    start = time.time()
+    set_dict = sets_price_history(list(cards_df['set_name'].unique()), cards_df, base_url=base_url, rate=rate)
+    elapsed = time.time() - start
+    server.shutdown()
+    print('{0} requests in {1:.2f}s at rate {2}'.format(n_sets*n_cards, elapsed, rate))
+    assert all(len(card_dict) == n_cards for card_dict in set_dict.values())
+    # one burst of rate requests, then the rest paced at rate per second
+    assert elapsed >= (n_sets*n_cards - rate)/rate * 0.9
+
+def test_scryfall_loader(n_pages=30, page_size=175):
+    """ Loads cards from a local fake scryfall API and a fake bulk data file, checking both against page by page loading """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    import threading, tempfile, os
+    def fake_card(page, i):
+        return {'id': '{0}-{1}'.format(page, i), 'name': 'Card {0}-{1}'.format(page, i), 'lang': 'en' if i % 9 else 'ja',
+                'legalities': {'vintage': 'legal' if i % 13 else 'not_legal'}, 'cmc': float(i % 7)}
+    pages = {page: [fake_card(page, i) for i in range(page_size)] for page in range(1, n_pages+1)}
+    class FakeScryfall(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = int(parse_qs(urlparse(self.path).query)['page'][0])
+            body = json.dumps({'object': 'list', 'data': pages[page]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeScryfall)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}/'.format(server.server_port)
+
+    start = time.time()
+    expected = pd.concat([load_card_page(page, base_url) for page in pages], sort=True)
+    print('page by page: {:.2f}s'.format(time.time()-start))
+    start = time.time()
+    cards = load_cards(n_pages, base_url=base_url, rate=None)
+    print('concurrent: {:.2f}s'.format(time.time()-start))
+    server.shutdown()
+    pd.testing.assert_frame_equal(cards, expected)
+
+    # bulk data files are a json array with one card per line
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'all-cards.json')
+        with open(path, 'w') as bulk_file:
+            bulk_file.write('[\n' + ',\n'.join(json.dumps(card) for page in pages for card in pages[page]) + '\n]')
+        bulk = load_bulk_cards(path, chunksize=1000)
+    pd.testing.assert_frame_equal(bulk, expected)
+
+def benchmark_price_history_parsing(n_points=2000, repeats=5):
+    """ Times the fast price history extraction against the javascript parser on a synthetic MTGPrice page, checking they agree """
+    rng = np.random.RandomState(0)
+    timestamps = np.sort(rng.randint(1300000000000, 1540000000000, size=n_points))
+    prices = rng.lognormal(1, 1, size=n_points).round(2)
+    data = ','.join('[{0},{1}]'.format(t, p) for t, p in zip(timestamps, prices))
+    page = ('<html><head><script type="text/javascript" src="/js/site.js"></script></head><body>'
+            '<script type="text/javascript">\n$(function() {\n'
+            'var results = [{"label": "Fair Price", "color": "#3e81d6", "data": [' + data + ']},'
+            '{"label": "Foil", "data": [[1500000000000, 9.99]]}];\n'
+            'plot(results);\n});\n</script></body></html>').encode()
+
+    for parse in [fast_price_history, slimit_price_history]:
+        start = time.time()
+        for _ in range(repeats):
+            history = parse(page)
+        print('{0}: {1:.4f}s per page'.format(parse.__name__, (time.time()-start)/repeats))
+        assert history.shape == (n_points, 2)
+        assert (history.astype(float)[:, 1] == prices).all()
+    assert (fast_price_history(page) == slimit_price_history(page)).all()
+
+def test_scrape_jobs(n_sets=4, n_cards=12, n_workers=2):
+    """
+    Runs a resumable scrape job against a local stub MTGPrice server and a sqlite stand-in database:
+    the first run fails some cards, the rerun only retries those
+    """
+    from scrape.jobs import run_scrape_job
+    import tempfile, os
+    requested = []
+    broken = {'on': True}
+    def stub(request):
+        requested.append(request.path)
+        # cards 5 and 10 of every set are down on the first run
+        if broken['on'] and request.path.endswith(('_5', '_10')):
+            return 503, {}
+        return 200, {}
+    server, base_url = stub_mtgprice_server(stub)
+
+    cards_df = pd.DataFrame([{'name': 'Card {}'.format(i), 'set_name': 'Set {}'.format(s), 'rarity': 'rare'}
+                             for s in range(n_sets) for i in range(1, n_cards+1)])
+    with tempfile.TemporaryDirectory() as tmp, sqlite_mystic_db(os.path.join(tmp, 'prices.db')):
+        job = dict(cards_df=cards_df, rarities=['rare'], state_path=os.path.join(tmp, 'state.db'),
+                   fails_path=os.path.join(tmp, '{}_fails.p'), base_url=base_url, retries=0)
+        progress = run_scrape_job('test', n_workers=n_workers, **job)
+        print(progress)
+        assert progress.loc['rare', 'failed'] == 2*n_sets and progress.loc['rare', 'done'] == (n_cards-2)*n_sets
+
+        broken['on'] = False
+        requested.clear()
+        progress = run_scrape_job('test', n_workers=n_workers, **job)
+        print(progress)
+        assert len(requested) == 2*n_sets
+        assert progress.loc['rare', 'done'] == n_cards*n_sets
+        with mystic_connection() as connection:
+            assert connection.execute('select count(*) from rare_price_history_test').scalar() == 2*n_cards*n_sets
+    server.shutdown()
+
+def test_incremental_ingestion(n_points=500, seed=0):
+    """ Records a price history in two incremental refreshes against a sqlite stand-in, checking it matches one full recording """
+    import tempfile, os
+    rng = np.random.RandomState(seed)
+    timestamps = np.sort(rng.choice(np.arange(1300000000000, 1540000000000, 3600000), size=n_points, replace=False))
+    prices = rng.choice([0, 0.98, 1.0, 1.04, 2.5, 2.46, 3.0], size=n_points)
+    history = np.array([timestamps.astype(str), prices.astype(str)]).T
+
+    with tempfile.TemporaryDirectory() as tmp, sqlite_mystic_db(os.path.join(tmp, 'prices.db')):
+        with mystic_connection() as connection:
+            record_price_history(connection, 'full_ph', 'Set', "Card's", history)
+            for refresh in [history[:n_points//3], history[:n_points//2], history]:
+                record_price_history(connection, 'incremental_ph', 'Set', "Card's", refresh, incremental=True)
+            full = pd.read_sql('select * from full_ph order by timestamp', connection)
+            incremental = pd.read_sql('select * from incremental_ph order by timestamp', connection)
+    print('{0} points recorded, {1} incrementally'.format(full.shape[0], incremental.shape[0]))
+    pd.testing.assert_frame_equal(full, incremental)
+
+def test_http_cache(n_cards=20):
+    """
+    Scrapes a stub MTGPrice set through the HTTP cache three times: cold, revalidated with ETags, then offline,
+    where a page that isn't cached fails at once instead of being retried
+    """
+    from scrape.fetch import HTTPCache, CacheMiss, fetch_pages
+    import tempfile
+    statuses = []
+    def stub(request):
+        etag = '"{}"'.format(abs(hash(request.path)))
+        status = 304 if request.headers.get('If-None-Match') == etag else 200
+        statuses.append(status)
+        return status, {'ETag': etag} if status == 200 else {}
+    server, base_url = stub_mtgprice_server(stub)
+    cards = ['Stub Card {}'.format(i) for i in range(n_cards)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = []
+        for cache in [HTTPCache(tmp), HTTPCache(tmp), HTTPCache(tmp, offline=True)]:
+            if cache.offline:
+                server.shutdown()
+            del statuses[:]
+            card_dict, failed = scrape_set_price_history('Stub Set', cards, base_url=base_url, rate=None, cache=cache)
+            assert not failed
+            runs.append(card_dict)
+            print('{0} responses: {1} full, {2} not modified'.format('offline' if cache.offline else 'online',
+                                                                     statuses.count(200), statuses.count(304)))
+        assert runs[0].keys() == runs[1].keys() == runs[2].keys()
+        assert all((runs[0][card] == runs[2][card]).all() for card in cards)
+        start = time.time()
+        missing = fetch_pages([base_url + 'Missing_Set/Missing_Card'], cache=cache, retries=3, backoff=5)
+        assert isinstance(missing[0], CacheMiss) and time.time() - start < 1
+    assert statuses == []
+
+def test_connection_pool(n=20):
+    """ Times n small lookups through the shared pooled engine, and checks they reuse it (set MYSTIC_DB_URL for a stand-in) """
+    from scrape import mystic_db
+    mystic_db.dispose_engine()
+    start = time.time()
+    for _ in range(n):
+        with mystic_connection() as connection:
+            connection.execute("select 1").fetchall()
+    print('{0} pooled lookups in {1:.3f}s against {2}'.format(n, time.time()-start, mystic_db.get_engine().url.drivername))
+    engine = mystic_db.get_engine()
+    with mystic_connection() as connection:
+        assert connection.engine is engine
+
+def test_price_history_export(rarity='mythic', version=2, chunksize=50000):
+    """ Exports a rarity's price history to a temporary parquet dataset, checking it and its seasonal averages against the database """
+    import tempfile, glob
+    seasons = np.array(pd.read_csv('data/season_dates.csv'))
+    with tempfile.TemporaryDirectory() as dataset:
+        start = time.time()
+        export_price_history([rarity], version, dataset, chunksize)
+        print('export: {:.2f}s'.format(time.time()-start))
+        local_df = read_price_history(dataset, rarities=[rarity])
+        db_df = get_price_history(rarity, version)
+        assert local_df.shape[0] == db_df.shape[0]
+
+        # pruned read: one set, one season
+        setname = db_df['setname'].iloc[0]
+        begin, end = season_bounds(seasons[-1:])[1:]
+        pruned_df = read_price_history(dataset, rarities=[rarity], sets=[setname], since=begin[0], until=end[0])
+        db_mask = (db_df['setname']==setname) & (db_df['timestamp'].astype(np.int64).between(begin[0], end[0]))
+        assert pruned_df.shape[0] == db_mask.sum()
+
+        # row groups of a set follow each other in time, so timestamp filters can skip them
+        for path in glob.glob(os.path.join(dataset, 'rarity='+rarity, '*', '*.parquet')):
+            metadata = pq.ParquetFile(path).metadata
+            ranges = [metadata.row_group(i).column(1).statistics for i in range(metadata.num_row_groups)]
+            assert all(a.max <= b.min for a, b in zip(ranges, ranges[1:])), 'row groups of {} overlap in time'.format(path)
+
+        # prices are float32 in the dataset
+        local_avgs = local_w_avg_price_by_season(local_df, seasons).set_index(['cardname','setname']).astype(float)
+        sql_avgs = w_avg_price_by_season(seasons, rarity+'_price_history_'+str(version)).set_index(['cardname','setname'])
+        diff = (local_avgs.sort_index() - sql_avgs.sort_index()).abs().max().max()
+        print('max seasonal average difference: {}'.format(diff))
+        assert diff < 1e-4
+
 def test_baseline_model():
     cards_df = combine_csv_rarities()
     baseline = BaselineModel()
@@ -70,6 +422,19 @@ def test_SpotPriceByRarityGBR():
     pipe.fit(cards_df, cards_df['price'])
     print("Train SpotPriceByRarityGBR Score: {}".format(pipe.score(cards_df, cards_df['price'])))
 
+def test_SpotPriceByRarityGBR_n_jobs(n_cards=1000, seed=0):
+    """ Fits SpotPriceByRarityGBR on the bundled CSVs with 1 and 2 jobs, checking the parallel fit predicts identically """
+    X, y = csv_cleaner(combine_csv_rarities().set_index('id').sample(n_cards, random_state=seed))
+    preds = []
+    for n_jobs in [1, 2]:
+        # subsampling makes the fits depend on random_state, so a worker reseeding a rarity model would show up
+        model = SpotPriceByRarityGBR(model=GradientBoostingRegressor(subsample=0.8, random_state=seed), n_jobs=n_jobs)
+        pipe = create_pipeline(model, "SpotPriceByRarityGBR", fused=True)
+        pipe.fit(X, y)
+        preds.append(pipe.predict(X))
+    assert (preds[0] == preds[1]).all(), "n_jobs=2 predictions differ from n_jobs=1"
+    print("SpotPriceByRarityGBR predicts the same with 1 and 2 jobs on {} cards".format(n_cards))
+
 def test_model_comparison():
     cards_df = combine_csv_rarities().sample(100)
     scorer = rmsle_scorer
@@ -96,11 +461,9 @@ def test_model_comparison():
                                  [pipe_b1, modelname_b1]], 
                                  cards_df, scorer, n_folds=2)
 
-def test_standard_normalizer():
-    """ Predicts Ixalan Prices for season 25. Trains on seasons 1-24 prices for everything """ 
-
+def ixalan_holdout():
+    """ Ixalan season 25 prices as the test set, with seasons 1-24 prices of earlier sets to train on """
     print("Getting standard format")
-    scorer = rmsle_scorer
     std_sets, std_dates = get_standard_format()
     
     print("Getting seasonal prices df")
@@ -119,7 +482,9 @@ def test_standard_normalizer():
     # Performing set exclusion transformation to get final training data
     print("Cleaning X and Y")
     X_train, y_train = csv_cleaner(X, y_col='s24')
+    return X_train, X_test, y_train, y_test, std_sets
 
+def standard_normalizer_pipeline(std_sets, backend=None):
     pipe = Pipeline([
         ('BoolToInt', BoolTransformer()),
         ('CreatureFeature', CreatureFeatureTransformer()),
@@ -131,8 +496,14 @@ def test_standard_normalizer():
         ('DummifyColorID', ColorIDTransformer()),
         ('DropFeatures', DropFeaturesTransformer()),
         ('TestFill', TestFillTransformer()),
-        ('StandardNormalizerGBR', StandardNormalizerGBR(std_sets_df = std_sets, log_y=True))
+        ('StandardNormalizerGBR', StandardNormalizerGBR(std_sets_df = std_sets, log_y=True, backend=backend))
     ])
+    return pipe
+
+def test_standard_normalizer(backend=None):
+    """ Predicts Ixalan Prices for season 25. Trains on seasons 1-24 prices for everything """ 
+    X_train, X_test, y_train, y_test, std_sets = ixalan_holdout()
+    pipe = standard_normalizer_pipeline(std_sets, backend)
     
     print("Fitting pipeline")
     pipe.fit(X_train, y_train)
@@ -142,6 +513,16 @@ def test_standard_normalizer():
 
     return pipe
 
+def benchmark_gbr_backends(backends=['exact', 'hist']):
+    """ Reports fit time and rmsle on the Ixalan holdout of StandardNormalizerGBR for each boosting backend """
+    X_train, X_test, y_train, y_test, std_sets = ixalan_holdout()
+    for backend in backends:
+        pipe = standard_normalizer_pipeline(std_sets, backend)
+        start = time.time()
+        pipe.fit(X_train, y_train)
+        fit_time = time.time() - start
+        print("{0} backend: fit in {1:.2f}s, Ixalan rmsle = {2:.4f}".format(backend, fit_time, -pipe.score(X_test, y_test)))
+
 def test_Ixalan_baseline():
     baseline = BaselineModel()
     df = join_features_seasonal_prices()
@@ -226,6 +607,89 @@ def plot_random_prices(n=100):
     plt.yscale('log')
     plt.show()
 
+def benchmark_typeline_transformer(rarities=['mythic','rare','uncommon','common']):
+    """ Times row-wise vs columnar TypelineTransformer on the bundled recent csvs, and checks they agree """
+    cards_df = combine_csv_rarities()
+    cards_df = cards_df[cards_df['rarity'].isin(rarities)]
+    results = {}
+    for vectorized in [False, True]:
+        xfmr = TypelineTransformer(vectorized=vectorized)
+        start = time.time()
+        results[vectorized] = xfmr.fit(cards_df).transform(cards_df)
+        print("vectorized={0}: {1:.3f}s for {2} cards".format(vectorized, time.time()-start, cards_df.shape[0]))
+
+    rows_df, cols_df = results[False], results[True]
+    assert set(rows_df.columns) == set(cols_df.columns), "TypelineTransformer paths produced different columns"
+    type_cols = list(xfmr.card_types | xfmr.mod_types)
+    assert (rows_df[type_cols].astype(int) == cols_df[type_cols]).all().all(), "type dummies differ"
+    for col in ['card_types', 'mod_types', 'sub_types']:
+        assert (rows_df[col] == cols_df[col]).all(), "{} differ".format(col)
+    print("TypelineTransformer outputs match")
+
+def benchmark_creature_features(rarities=['mythic','rare','uncommon','common']):
+    """ Reports rows/second of row-wise vs columnar CreatureFeatureTransformer on each bundled recent csv """
+    engineered = ['pt_type', 'power', 'toughness', 'p:t', 'avg_pt', 'cmc:apt']
+    for rarity in rarities:
+        cards_df = pd.read_csv('data/all_vintage_cards-{}_recent.csv'.format(rarity))
+        results = {}
+        for vectorized in [False, True]:
+            start = time.time()
+            results[vectorized] = CreatureFeatureTransformer(vectorized=vectorized).transform(cards_df)
+            elapsed = time.time() - start
+            print("{0} vectorized={1}: {2:.0f} rows/s".format(rarity, vectorized, cards_df.shape[0]/elapsed))
+        rows_df, cols_df = results[False], results[True]
+        assert (rows_df['pt_type'] == cols_df['pt_type']).all(), "pt_type differs for {}s".format(rarity)
+        assert np.allclose(rows_df[engineered[1:]].astype(float), cols_df[engineered[1:]], equal_nan=True), \
+            "creature features differ for {}s".format(rarity)
+    print("CreatureFeatureTransformer outputs match")
+
+def test_card_feature_engine():
+    """ Checks the fused CardFeatureEngine reproduces the chained create_pipeline features, on train and holdout """
+    X, y = csv_cleaner(combine_csv_rarities().set_index('id'))
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+
+    chained = Pipeline(create_pipeline(BaselineModel(), "Baseline").steps[:-1])
+    chained.fit(X_train, y_train)
+    engine = CardFeatureEngine(as_frame=True).fit(X_train)
+
+    for X_check in [X_train, X_test]:
+        chain_df = chained.transform(X_check)
+        engine_df = engine.transform(X_check)
+        assert set(chain_df.columns) == set(engine_df.columns), "engine columns differ from chained pipeline"
+        cols = list(engine_df.columns)
+        assert np.allclose(chain_df[cols].astype(np.float32).values, engine_df.values), "engine features differ"
+    print("CardFeatureEngine matches chained pipeline on {} features".format(len(engine.train_columns_)))
+
+def test_feature_cache():
+    """
+    Checks a cached create_pipeline reproduces the uncached features, and that a rerun on refreshed prices
+    (new timestamps & row numbers, same cards) is served entirely from the cache
+    """
+    import tempfile, glob
+    X, y = csv_cleaner(combine_csv_rarities().set_index('id'))
+    uncached = Pipeline(create_pipeline(BaselineModel(), "Baseline").steps[:-1]).fit(X, y)
+    expected_df = uncached.transform(X)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cached = Pipeline(create_pipeline(BaselineModel(), "Baseline", cache_dir=tmp).steps[:-1]).fit(X, y)
+        cold_df = cached.transform(X)
+        stores = {path: os.stat(path).st_mtime_ns for path in glob.glob(os.path.join(tmp, '*.npz'))}
+        assert len(stores) == 4, "expected a store per cached stage"
+
+        refreshed = X.copy()
+        for col in ['timestamp', 'Unnamed: 0']:
+            if col in refreshed.columns:
+                refreshed[col] = refreshed[col] + 1
+        warm_df = cached.transform(refreshed)
+        assert all(os.stat(path).st_mtime_ns == mtime for path, mtime in stores.items()), "rerun missed the cache"
+
+        for cache_df in [cold_df, warm_df]:
+            assert list(cache_df.columns) == list(expected_df.columns), "cached columns differ"
+            cols = [col for col in expected_df.columns if col not in ['timestamp', 'Unnamed: 0']]
+            assert np.allclose(cache_df[cols].astype(float).values, expected_df[cols].astype(float).values, equal_nan=True), \
+                "cached features differ"
+    print("FeatureCache matches uncached pipeline and serves reruns from disk")
+
 def compare_to_craig():
     craigs_df, cards = get_craigs_picks()
 